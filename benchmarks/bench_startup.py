@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark for KoeLink
+Compares the cost of `main.py --check` with eagerly importing every service module
+"""
+
+import os
+import sys
+import time
+import subprocess
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+EAGER_IMPORTS = (
+    "import config.settings, utils.file_utils, "
+    "modules.speechflow_transcription, modules.chatgpt_text_correction, "
+    "modules.deepl_translation, modules.genny_synthesis"
+)
+
+
+def time_command(args, runs):
+    """Return the best wall time (seconds) of running a command several times"""
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(args, cwd=project_root, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def top_imports(args, limit=10):
+    """Return the slowest cumulative imports reported by -X importtime"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime"] + args,
+        cwd=project_root, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative), name.rstrip()))
+    return sorted(rows, reverse=True)[:limit]
+
+
+def main():
+    """Main function"""
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    
+    baseline = time_command([sys.executable, "-c", "pass"], runs)
+    check = time_command([sys.executable, "main.py", "--check"], runs)
+    eager = time_command([sys.executable, "-c", EAGER_IMPORTS], runs)
+    
+    print(f"=== Startup benchmark (best of {runs}) ===")
+    print(f"Interpreter only:        {baseline * 1000:8.1f} ms")
+    print(f"main.py --check:         {check * 1000:8.1f} ms")
+    print(f"Eager service imports:   {eager * 1000:8.1f} ms")
+    
+    print("\nSlowest imports for main.py --check (cumulative us):")
+    for cumulative, name in top_imports(["main.py", "--check"]):
+        print(f"  {cumulative:>10,}  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,13 +6,22 @@ import os
 from dotenv import load_dotenv
 
 
+# Choices accepted by the services; checked up front so a typo fails before any API is paid for
+SUPPORTED_AUDIO_FORMATS = ("wav", "flac", "mp3", "opus")
+SUPPORTED_CORRECTION_MODES = ("edits", "rewrite")
+SUPPORTED_TRANSCRIPT_CACHE_KEYS = ("audio", "file")
+
+
 class Settings:
     def __init__(self, env_path=".env"):
         """Initialize settings by loading environment variables"""
         self.env_path = env_path
+        self.invalid_settings = []
         self.load_environment()
         self.load_api_keys()
         self.set_default_paths()
+        self.load_rate_limits()
+        self.load_prices()
 
     def load_environment(self):
         """Load environment variables from .env file"""
@@ -22,6 +31,15 @@ class Settings:
         else:
             print(f"Warning: .env file not found at {self.env_path}")
 
+    def get_number(self, name, default, cast=float):
+        """Read a numeric environment variable, recording invalid values for validate_settings"""
+        value = os.getenv(name, default)
+        try:
+            return cast(value)
+        except ValueError:
+            self.invalid_settings.append(f"{name}={value!r} is not a valid {cast.__name__}")
+            return cast(default)
+
     def load_api_keys(self):
         """Load API keys from environment variables"""
         self.speechflow_api_key_id = os.getenv("SPEECHFLOW_API_KEY_ID")
@@ -38,6 +56,66 @@ class Settings:
         self.context_path = os.getenv("CONTEXT_PATH", "./data/context.txt")
         self.prompt_fix_jp_path = os.getenv("PROMPT_FIX_JP_PATH", "./data/prompt_fix_jp.txt")
         self.output_dir = os.getenv("OUTPUT_DIR", "./output")
+        self.audio_format = os.getenv("AUDIO_FORMAT", "wav").lower()
+        self.audio_bitrate = os.getenv("AUDIO_BITRATE")
+        self.encode_workers = self.get_number("ENCODE_WORKERS", "2", int)
+        self.rate_limit_dir = os.getenv("RATE_LIMIT_DIR")
+        self.job_deadline = self.get_number("JOB_DEADLINE", "0")
+        self.request_timeout = self.get_number("REQUEST_TIMEOUT", "120")
+        self.hedge_percentile = self.get_number("HEDGE_PERCENTILE", "95")
+        self.latency_history = os.getenv("LATENCY_HISTORY", "./cache/latency_history.json")
+        self.speechflow_result_type = self.get_number("SPEECHFLOW_RESULT_TYPE", "1", int)
+        self.correction_gating = os.getenv("CORRECTION_GATING", "true").lower() in ("1", "true", "yes")
+        self.confidence_threshold = self.get_number("CONFIDENCE_THRESHOLD", "0.85")
+        self.unknown_term_ratio = self.get_number("UNKNOWN_TERM_RATIO", "0.5")
+        self.correction_mode = os.getenv("CORRECTION_MODE", "edits").lower()
+        self.transcript_cache = os.getenv("TRANSCRIPT_CACHE", "true").lower() in ("1", "true", "yes")
+        self.transcript_cache_dir = os.getenv("TRANSCRIPT_CACHE_DIR", "./cache/transcripts")
+        self.transcript_cache_key = os.getenv("TRANSCRIPT_CACHE_KEY", "audio").lower()
+        self.tts_planner_state = os.getenv("TTS_PLANNER_STATE", "./cache/tts_planner.json")
+        self.performance_history = os.getenv("PERFORMANCE_HISTORY", "./cache/performance_history.json")
+
+    def load_prices(self):
+        """Load API prices used for cost forecasts (USD)"""
+        self.prices = {
+            "speechflow_per_hour": self.get_number("SPEECHFLOW_PRICE_PER_HOUR", "0"),
+            "openai_input_per_million": self.get_number("OPENAI_INPUT_PRICE", "2.5"),
+            "openai_output_per_million": self.get_number("OPENAI_OUTPUT_PRICE", "10"),
+            "deepl_per_million_chars": self.get_number("DEEPL_PRICE", "25"),
+            "genny_per_million_chars": self.get_number("GENNY_PRICE", "0"),
+        }
+
+    def load_rate_limits(self):
+        """
+        Load per-provider quotas (0 disables a limit). Limits that are not set
+        explicitly are defaults and give way to limits learned from response headers.
+        """
+        self.explicit_rate_limits = {
+            provider: [name for name in names if os.getenv(f"{provider.upper()}_{name.upper()}") is not None]
+            for provider, names in {
+                "openai": ("rpm", "tpm"),
+                "deepl": ("rpm", "cps"),
+                "speechflow": ("rpm",),
+                "genny": ("rpm", "cps"),
+            }.items()
+        }
+        self.rate_limits = {
+            "openai": {
+                "rpm": self.get_number("OPENAI_RPM", "500"),
+                "tpm": self.get_number("OPENAI_TPM", "30000"),
+            },
+            "deepl": {
+                "rpm": self.get_number("DEEPL_RPM", "60"),
+                "cps": self.get_number("DEEPL_CPS", "0"),
+            },
+            "speechflow": {
+                "rpm": self.get_number("SPEECHFLOW_RPM", "30"),
+            },
+            "genny": {
+                "rpm": self.get_number("GENNY_RPM", "60"),
+                "cps": self.get_number("GENNY_CPS", "0"),
+            },
+        }
 
     def validate_api_keys(self):
         """Validate that all required API keys are present"""
@@ -62,6 +140,40 @@ class Settings:
         
         return True
 
+    def validate_settings(self):
+        """Validate numeric and choice settings"""
+        problems = list(self.invalid_settings)
+        
+        choices = {
+            "AUDIO_FORMAT": (self.audio_format, SUPPORTED_AUDIO_FORMATS),
+            "CORRECTION_MODE": (self.correction_mode, SUPPORTED_CORRECTION_MODES),
+            "TRANSCRIPT_CACHE_KEY": (self.transcript_cache_key, SUPPORTED_TRANSCRIPT_CACHE_KEYS),
+        }
+        for name, (value, supported) in choices.items():
+            if value not in supported:
+                problems.append(f"{name}={value!r} is not supported (supported: {', '.join(supported)})")
+        
+        ranges = {
+            "ENCODE_WORKERS": (self.encode_workers, 0, None),
+            "JOB_DEADLINE": (self.job_deadline, 0, None),
+            "REQUEST_TIMEOUT": (self.request_timeout, 1, None),
+            "HEDGE_PERCENTILE": (self.hedge_percentile, 1, 100),
+            "CONFIDENCE_THRESHOLD": (self.confidence_threshold, 0, 1),
+            "UNKNOWN_TERM_RATIO": (self.unknown_term_ratio, 0, 1),
+        }
+        for provider, limits in self.rate_limits.items():
+            for limit, value in limits.items():
+                ranges[f"{provider.upper()}_{limit.upper()}"] = (value, 0, None)
+        for name, (value, low, high) in ranges.items():
+            if value < low or (high is not None and value > high):
+                bounds = f"between {low} and {high}" if high is not None else f"at least {low}"
+                problems.append(f"{name}={value} must be {bounds}")
+        
+        if problems:
+            raise ValueError("Invalid settings: " + "; ".join(problems))
+        
+        return True
+
     def validate_files(self):
         """Validate that required files exist"""
         required_files = [
@@ -79,11 +191,39 @@ class Settings:
         
         return True
 
+    def get_rate_limit_config(self):
+        """Get rate limiter configuration"""
+        return {
+            "limits": self.rate_limits,
+            "explicit_limits": self.explicit_rate_limits,
+            "state_dir": self.rate_limit_dir,
+        }
+
+    def get_latency_config(self):
+        """Get deadline, timeout and hedging configuration"""
+        return {
+            "job_deadline": self.job_deadline,
+            "request_timeout": self.request_timeout,
+            "hedge_percentile": self.hedge_percentile,
+            "latency_history": self.latency_history,
+        }
+
+    def get_estimator_config(self):
+        """Get time and cost estimator configuration"""
+        return {
+            "history_path": self.performance_history,
+            "prices": self.prices,
+        }
+
     def get_speechflow_config(self):
         """Get SpeechFlow configuration"""
         return {
             "api_key_id": self.speechflow_api_key_id,
             "api_key_secret": self.speechflow_api_key_secret,
+            "result_type": self.speechflow_result_type,
+            "cache": self.transcript_cache,
+            "cache_dir": self.transcript_cache_dir,
+            "cache_key": self.transcript_cache_key,
         }
 
     def get_chatgpt_config(self):
@@ -92,6 +232,10 @@ class Settings:
             "api_key": self.openai_api_key,
             "context_path": self.context_path,
             "prompt_path": self.prompt_fix_jp_path,
+            "gating": self.correction_gating,
+            "mode": self.correction_mode,
+            "confidence_threshold": self.confidence_threshold,
+            "unknown_term_ratio": self.unknown_term_ratio,
         }
 
     def get_deepl_config(self):
@@ -108,6 +252,10 @@ class Settings:
             "speaker": self.genny_speaker,
             "speaker_style": self.genny_speaker_style,
             "output_dir": self.output_dir,
+            "audio_format": self.audio_format,
+            "audio_bitrate": self.audio_bitrate,
+            "encode_workers": self.encode_workers,
+            "planner_state": self.tts_planner_state,
         }
 
     def print_config_summary(self):
@@ -116,6 +264,7 @@ class Settings:
         print(f"Context file: {self.context_path}")
         print(f"Prompt file: {self.prompt_fix_jp_path}")
         print(f"Output directory: {self.output_dir}")
+        print(f"Audio format: {self.audio_format}")
         print(f"SpeechFlow API: {'✓' if self.speechflow_api_key_id else '✗'}")
         print(f"OpenAI API: {'✓' if self.openai_api_key else '✗'}")
         print(f"Genny API: {'✓' if self.genny_api_key else '✗'}")
@@ -6,8 +6,8 @@ Converts Japanese audio/video to English audio with scripts
 
 import sys
 import os
-from datetime import datetime
-import pytz
+import time
+import argparse
 
 # Fix encoding issues on Windows
 if sys.platform == "win32":
@@ -22,13 +22,11 @@ if sys.platform == "win32":
 project_root = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, project_root)
 
+# Service modules (openai, deepl, pydub, requests) are imported lazily on first use
 from config.settings import Settings
-from modules.speechflow_transcription import SpeechFlowTranscriber
-from modules.chatgpt_text_correction import ChatGPTTextCorrector
-from modules.deepl_translation import DeepLTranslator
-from modules.genny_synthesis import GennySynthesizer
 from utils.file_utils import (
     get_media_file_path, 
+    get_media_duration, 
     save_japanese_script, 
     get_timestamp, 
     print_completion_summary
@@ -39,55 +37,201 @@ class KoeLink:
     def __init__(self, env_path=".env"):
         """Initialize the KoeLink application"""
         self.settings = Settings(env_path)
-        self.timestamp = get_timestamp()
+        self.timestamp = None  # taken when processing starts, so --check never loads pytz
         
-        # Initialize service components
-        self.transcriber = None
-        self.corrector = None
-        self.translator = None
-        self.synthesizer = None
+        # Service components are created lazily on first use
+        self._transcriber = None
+        self._corrector = None
+        self._translator = None
+        self._synthesizer = None
+        self._rate_limiter = None
+        self._latency_tracker = None
+        self._estimator = None
         
         print("KoeLink initialized")
 
-    def setup_services(self):
-        """Setup all service components"""
-        try:
-            # Validate configuration
-            self.settings.validate_api_keys()
-            self.settings.validate_files()
-            self.settings.print_config_summary()
-            
-            # Initialize services
+    @property
+    def rate_limiter(self):
+        """Host-wide rate limiter shared by all services"""
+        if self._rate_limiter is None:
+            from utils.rate_limiter import RateLimiter
+            rate_limit_config = self.settings.get_rate_limit_config()
+            self._rate_limiter = RateLimiter(
+                rate_limit_config["limits"],
+                rate_limit_config["state_dir"],
+                explicit_limits=rate_limit_config["explicit_limits"]
+            )
+        return self._rate_limiter
+
+    @property
+    def latency_tracker(self):
+        """Per-operation latency histograms shared by all services"""
+        if self._latency_tracker is None:
+            from utils.latency import LatencyTracker
+            latency_config = self.settings.get_latency_config()
+            self._latency_tracker = LatencyTracker(
+                latency_config["hedge_percentile"],
+                history_path=latency_config["latency_history"]
+            )
+        return self._latency_tracker
+
+    @property
+    def estimator(self):
+        """Time and cost estimator backed by the performance history"""
+        if self._estimator is None:
+            from utils.estimator import Estimator, PerformanceHistory
+            estimator_config = self.settings.get_estimator_config()
+            self._estimator = Estimator(
+                PerformanceHistory(estimator_config["history_path"]),
+                estimator_config["prices"]
+            )
+        return self._estimator
+
+    @property
+    def transcriber(self):
+        """SpeechFlow transcriber (created on first use)"""
+        if self._transcriber is None:
+            from modules.speechflow_transcription import SpeechFlowTranscriber
             speechflow_config = self.settings.get_speechflow_config()
-            self.transcriber = SpeechFlowTranscriber(
+            transcript_cache = None
+            if speechflow_config["cache"]:
+                from utils.transcript_cache import TranscriptCache
+                transcript_cache = TranscriptCache(
+                    speechflow_config["cache_dir"],
+                    speechflow_config["cache_key"],
+                    self.settings.request_timeout
+                )
+            self._transcriber = SpeechFlowTranscriber(
                 speechflow_config["api_key_id"],
-                speechflow_config["api_key_secret"]
+                speechflow_config["api_key_secret"],
+                result_type=speechflow_config["result_type"],
+                rate_limiter=self.rate_limiter,
+                request_timeout=self.settings.request_timeout,
+                latency_tracker=self.latency_tracker,
+                transcript_cache=transcript_cache
             )
-            
+        return self._transcriber
+
+    @property
+    def corrector(self):
+        """ChatGPT text corrector (created on first use)"""
+        if self._corrector is None:
+            from modules.chatgpt_text_correction import ChatGPTTextCorrector
             chatgpt_config = self.settings.get_chatgpt_config()
-            self.corrector = ChatGPTTextCorrector(chatgpt_config["api_key"])
-            
+            self._corrector = ChatGPTTextCorrector(
+                chatgpt_config["api_key"],
+                correction_mode=chatgpt_config["mode"],
+                rate_limiter=self.rate_limiter,
+                request_timeout=self.settings.request_timeout,
+                latency_tracker=self.latency_tracker
+            )
+        return self._corrector
+
+    @property
+    def translator(self):
+        """DeepL translator (created on first use)"""
+        if self._translator is None:
+            from modules.deepl_translation import DeepLTranslator
             deepl_config = self.settings.get_deepl_config()
-            self.translator = DeepLTranslator(deepl_config["auth_key"])
-            
+            self._translator = DeepLTranslator(
+                deepl_config["auth_key"],
+                rate_limiter=self.rate_limiter,
+                latency_tracker=self.latency_tracker,
+                request_timeout=self.settings.get_latency_config()["request_timeout"]
+            )
+        return self._translator
+
+    @property
+    def synthesizer(self):
+        """Genny synthesizer (created on first use)"""
+        if self._synthesizer is None:
+            from modules.genny_synthesis import GennySynthesizer
+            from modules.chunk_planner import ChunkPlanner
             genny_config = self.settings.get_genny_config()
-            self.synthesizer = GennySynthesizer(
+            chunk_planner = ChunkPlanner(
+                genny_config["planner_state"],
+                f"{genny_config['speaker']}:{genny_config['speaker_style']}"
+            )
+            self._synthesizer = GennySynthesizer(
                 genny_config["api_url"],
                 genny_config["api_key"],
                 genny_config["speaker"],
                 genny_config["speaker_style"],
-                genny_config["output_dir"]
+                genny_config["output_dir"],
+                genny_config["audio_format"],
+                genny_config["audio_bitrate"],
+                genny_config["encode_workers"],
+                rate_limiter=self.rate_limiter,
+                request_timeout=self.settings.request_timeout,
+                latency_tracker=self.latency_tracker,
+                chunk_planner=chunk_planner
             )
-            
-            print("All services initialized successfully")
+        return self._synthesizer
+
+    def preflight(self):
+        """Validate configuration without importing or creating any service client"""
+        try:
+            self.settings.validate_settings()
+            self.settings.validate_api_keys()
+            self.settings.validate_files()
+            self.settings.print_config_summary()
             return True
             
         except Exception as e:
-            print(f"Error setting up services: {e}")
+            print(f"Error in configuration: {e}")
+            return False
+
+    def forecast(self, file_path):
+        """Forecast time, cost and memory for a media file, or None if its duration is unknown"""
+        from utils.estimator import print_forecast
+        duration = get_media_duration(file_path)
+        if duration is None:
+            print(f"Could not read media duration for {file_path}; no forecast available")
+            return None
+        
+        file_size = 0 if file_path.startswith('http') else os.path.getsize(file_path)
+        forecast = self.estimator.forecast(duration, file_size)
+        print_forecast(forecast, file_path)
+        return forecast
+
+    def estimate(self, file_paths, budget_seconds=None):
+        """Print forecasts for media files and, with a budget, pack them into batches"""
+        from utils.estimator import pack_jobs
+        jobs = []
+        for file_path in file_paths:
+            forecast = self.forecast(file_path)
+            if forecast:
+                jobs.append((file_path, forecast))
+        
+        if budget_seconds and jobs:
+            print(f"=== Batches (budget {budget_seconds / 60:.1f} min) ===")
+            for number, batch in enumerate(pack_jobs(jobs, budget_seconds), 1):
+                print(f"Batch {number}: {batch['seconds'] / 60:.1f} min - {', '.join(batch['jobs'])}")
+        
+        return len(jobs) == len(file_paths)
+
+    def setup_services(self):
+        """Validate configuration; service clients are created on first use"""
+        if not self.preflight():
             return False
+        
+        print("Configuration validated. Services will be initialized on first use")
+        return True
 
     def process_audio(self, file_path):
         """Process audio file through the complete pipeline"""
+        from utils.latency import Deadline
+        deadline = Deadline(self.settings.job_deadline)
+        stage_seconds = {}
+        if self.timestamp is None:
+            self.timestamp = get_timestamp()
+        
+        try:
+            forecast = self.forecast(file_path)
+        except Exception as e:
+            print(f"Warning: could not forecast this run: {e}")
+            forecast = None
+        
         try:
             print(f"\n{'='*50}")
             print("Starting KoeLink processing...")
@@ -97,27 +241,50 @@ class KoeLink:
             
             # Step 1: Transcribe Japanese audio
             print("\n🎤 Step 1: Transcribing Japanese audio...")
-            original_jp_text = self.transcriber.transcribe(file_path)
+            stage_start = time.monotonic()
+            original_jp_text = self.transcriber.transcribe(file_path, deadline=deadline)
             
             if not original_jp_text:
                 print("❌ Transcription failed. Aborting process.")
                 return False
             
+            stage_seconds["transcription"] = time.monotonic() - stage_start
             print(f"✅ Transcription completed. Length: {len(original_jp_text)} characters")
             
             # Step 2: Correct Japanese text
             print("\n🔧 Step 2: Correcting Japanese text...")
+            stage_start = time.monotonic()
             chatgpt_config = self.settings.get_chatgpt_config()
-            corrected_jp_text = self.corrector.correct_text(
-                original_jp_text,
-                chatgpt_config["context_path"],
-                chatgpt_config["prompt_path"]
-            )
+            use_sentences = chatgpt_config["gating"] or chatgpt_config["mode"] == "edits"
+            if use_sentences and self.transcriber.sentences:
+                gate = None
+                if chatgpt_config["gating"]:
+                    from modules.correction_gate import CorrectionGate
+                    gate = CorrectionGate(
+                        self.corrector.load_context(chatgpt_config["context_path"]),
+                        chatgpt_config["confidence_threshold"],
+                        chatgpt_config["unknown_term_ratio"]
+                    )
+                corrected_jp_text = self.corrector.correct_sentences(
+                    self.transcriber.sentences,
+                    chatgpt_config["context_path"],
+                    chatgpt_config["prompt_path"],
+                    deadline=deadline,
+                    gate=gate
+                )
+            else:
+                corrected_jp_text = self.corrector.correct_text(
+                    original_jp_text,
+                    chatgpt_config["context_path"],
+                    chatgpt_config["prompt_path"],
+                    deadline=deadline
+                )
             
             if not corrected_jp_text:
                 print("❌ Text correction failed. Aborting process.")
                 return False
             
+            stage_seconds["correction"] = time.monotonic() - stage_start
             print(f"✅ Text correction completed. Length: {len(corrected_jp_text)} characters")
             
             # Save Japanese script
@@ -125,28 +292,51 @@ class KoeLink:
             
             # Step 3: Translate to English
             print("\n🌐 Step 3: Translating to English...")
-            english_text = self.translator.translate(corrected_jp_text)
+            stage_start = time.monotonic()
+            english_text = self.translator.translate(corrected_jp_text, deadline=deadline)
             
             if not english_text:
                 print("❌ Translation failed. Aborting process.")
                 return False
             
+            stage_seconds["translation"] = time.monotonic() - stage_start
             print(f"✅ Translation completed. Length: {len(english_text)} characters")
             
             # Step 4: Generate English speech
             print("\n🔊 Step 4: Generating English speech...")
-            self.synthesizer.synthesize(english_text, self.timestamp)
+            stage_start = time.monotonic()
+            self.synthesizer.synthesize(english_text, self.timestamp, deadline=deadline)
+            stage_seconds["synthesis"] = time.monotonic() - stage_start
             
             print("✅ Speech synthesis completed")
             
             # Show completion summary
             print_completion_summary(self.settings.output_dir)
             
+            if forecast:
+                try:
+                    self.estimator.record_run(forecast, {
+                        "duration_seconds": forecast["duration_seconds"],
+                        "jp_chars": len(original_jp_text),
+                        "en_chars": len(english_text),
+                        "input_tokens": self.corrector.usage["input_tokens"],
+                        "output_tokens": self.corrector.usage["output_tokens"],
+                        "transcript_cached": self.transcriber.cache_hit,
+                        "stage_seconds": stage_seconds,
+                    })
+                except Exception as e:
+                    print(f"Warning: could not record this run for forecasts: {e}")
+            
             return True
             
         except Exception as e:
             print(f"❌ Error during processing: {e}")
             return False
+        
+        finally:
+            if self._latency_tracker is not None:
+                self._latency_tracker.print_summary()
+                self._latency_tracker.save()
 
     def run(self):
         """Main application entry point"""
@@ -185,12 +375,25 @@ class KoeLink:
 
 def main():
     """Main function"""
-    # Check for custom .env path
-    env_path = sys.argv[1] if len(sys.argv) > 1 else ".env"
+    parser = argparse.ArgumentParser(description="KoeLink - Japanese to English audio")
+    parser.add_argument("env_path", nargs="?", default=".env", help="path to the .env file")
+    parser.add_argument("--check", action="store_true",
+                        help="validate configuration and exit without processing")
+    parser.add_argument("--estimate", nargs="+", metavar="FILE",
+                        help="forecast time, cost and memory for media files and exit")
+    parser.add_argument("--budget", type=float, metavar="SECONDS",
+                        help="with --estimate, pack the files into batches of this forecast wall time")
+    args = parser.parse_args()
     
     # Create and run the application
-    app = KoeLink(env_path)
-    success = app.run()
+    app = KoeLink(args.env_path)
+    if args.check:
+        success = app.preflight()
+        print("✅ Preflight check passed" if success else "❌ Preflight check failed")
+    elif args.estimate:
+        success = app.estimate(args.estimate, args.budget)
+    else:
+        success = app.run()
     
     # Exit with appropriate code
     sys.exit(0 if success else 1)
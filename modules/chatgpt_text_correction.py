@@ -2,83 +2,358 @@
 ChatGPT text correction module for VoiceTranslateFlow
 """
 
-from openai import OpenAI
+import re
+import json
+import time
+from difflib import SequenceMatcher
+from openai import OpenAI, RateLimitError
+from utils.latency import Deadline
+
+
+# Neighbouring sentences are sent as read-only context lines starting with ">"
+CONTEXT_LINE_PREFIX = ">"
+
+CONTEXT_LINES_INSTRUCTION = (
+    f'Lines starting with "{CONTEXT_LINE_PREFIX}" are the surrounding sentences, shown for context only; '
+    "never correct or return them. "
+)
+
+NUMBERED_LINES_INSTRUCTION = CONTEXT_LINES_INSTRUCTION + (
+    "Each other line starts with a number in square brackets, e.g. [12]. "
+    "Return every line with the same number in front of it, one line per number, "
+    "without merging, splitting or reordering lines."
+)
+
+NUMBERED_LINE_PATTERN = re.compile(r"^\[(\d+)\]\s*(.*)$")
+
+# Marks the section of the prompt template that describes the output layout;
+# the sentence modes replace it with their own format instruction
+OUTPUT_FORMAT_MARKER = "### Output format"
+
+EDIT_LIST_INSTRUCTION = CONTEXT_LINES_INSTRUCTION + (
+    "Each other line starts with a number in square brackets, e.g. [12]. "
+    "Do not return the text. Return only a JSON object of the form "
+    '{"edits": [{"index": 12, "text": "corrected sentence"}]}, '
+    "with one entry per line that needs a correction, containing the full corrected line "
+    "without its number. Lines that need no correction must be left out. "
+    'If nothing needs correcting, return {"edits": []}.'
+)
 
 
 class ChatGPTTextCorrector:
-    def __init__(self, api_key, model="gpt-4o", max_tokens=800, max_requests=40):
+    def __init__(self, api_key, model="gpt-4o", max_tokens=800, max_requests=40,
+                 rate_limiter=None, max_rate_limit_retries=3, request_timeout=120,
+                 latency_tracker=None, max_batch_chars=3000, correction_mode="edits",
+                 max_edit_tokens=4000, min_edit_similarity=0.5, context_sentences=1):
         self.api_key = api_key
         self.model = model
         self.max_tokens = max_tokens
         self.max_requests = max_requests
+        self.rate_limiter = rate_limiter
+        self.max_rate_limit_retries = max_rate_limit_retries
+        self.request_timeout = request_timeout
+        self.latency_tracker = latency_tracker
+        self.max_batch_chars = max_batch_chars
+        if correction_mode not in ("edits", "rewrite"):
+            raise ValueError(f"Unsupported correction mode: {correction_mode} (supported: edits, rewrite)")
+        self.correction_mode = correction_mode
+        self.max_edit_tokens = max_edit_tokens
+        self.min_edit_similarity = min_edit_similarity
+        self.context_sentences = context_sentences
+        self.file_cache = {}
+        self.system_prompts = {}
+        self.reset_usage()
+        self.deadline = Deadline()
         self.client = OpenAI(api_key=api_key)
 
+    def estimate_tokens(self, messages, max_tokens):
+        """Rough token estimate for quota accounting (about one token per Japanese character)"""
+        return sum(len(message["content"]) for message in messages) + max_tokens
+
+    def create_completion(self, messages, max_tokens=None, **options):
+        """Send a chat completion request through the shared rate limiter"""
+        max_tokens = max_tokens or self.max_tokens
+        attempt = 0
+        while True:
+            if self.rate_limiter:
+                self.rate_limiter.acquire("openai", tokens=self.estimate_tokens(messages, max_tokens))
+            client = self.client.with_options(timeout=self.deadline.timeout(self.request_timeout))
+            start_time = time.monotonic()
+            try:
+                raw_response = client.chat.completions.with_raw_response.create(
+                    model=self.model,
+                    messages=messages,
+                    temperature=0.3,
+                    max_tokens=max_tokens,
+                    **options
+                )
+            except RateLimitError as e:
+                attempt += 1
+                if not self.rate_limiter or attempt > self.max_rate_limit_retries:
+                    raise
+                self.rate_limiter.record_rate_limited("openai", e.response.headers)
+                continue
+            
+            if self.latency_tracker:
+                self.latency_tracker.record("openai.completion", time.monotonic() - start_time)
+            if self.rate_limiter:
+                self.rate_limiter.update_from_headers("openai", raw_response.headers)
+            response = raw_response.parse()
+            self.record_usage(response)
+            return response
+
+    def reset_usage(self):
+        """Reset token usage counters"""
+        self.usage = {"requests": 0, "input_tokens": 0, "cached_tokens": 0, "output_tokens": 0}
+
+    def record_usage(self, response):
+        """Accumulate input (cached and uncached) and output tokens from a response"""
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        self.usage["requests"] += 1
+        self.usage["input_tokens"] += usage.prompt_tokens or 0
+        self.usage["cached_tokens"] += getattr(details, "cached_tokens", 0) or 0
+        self.usage["output_tokens"] += usage.completion_tokens or 0
+
+    def print_usage_summary(self):
+        """Print cached versus uncached input tokens for this correction"""
+        input_tokens = self.usage["input_tokens"]
+        cached_tokens = self.usage["cached_tokens"]
+        cached_share = cached_tokens / input_tokens * 100 if input_tokens else 0.0
+        print(f"[Usage] {self.usage['requests']} requests, input {input_tokens} tokens "
+              f"({cached_tokens} cached, {input_tokens - cached_tokens} uncached, {cached_share:.1f}% cached), "
+              f"output {self.usage['output_tokens']} tokens")
+
+    def read_file(self, path):
+        """Read a text file once and serve later reads from memory"""
+        if path not in self.file_cache:
+            with open(path, 'r', encoding='utf-8') as file:
+                self.file_cache[path] = file.read()
+        return self.file_cache[path]
+
     def load_context(self, context_path):
         """Load context from file"""
         try:
-            with open(context_path, 'r', encoding='utf-8') as file:
-                return file.read()
+            return self.read_file(context_path)
         except FileNotFoundError:
             print(f"Context file not found: {context_path}")
             return ""
 
-    def load_prompt(self, prompt_path, script_text):
-        """Load and format prompt with script text"""
+    def load_instructions(self, prompt_path):
+        """Load the prompt template as static instructions, without the script placeholder"""
         try:
-            with open(prompt_path, 'r', encoding='utf-8') as file:
-                prompt_template = file.read()
-            return prompt_template.format(script_var=script_text)
+            prompt_template = self.read_file(prompt_path)
         except FileNotFoundError:
             print(f"Prompt file not found: {prompt_path}")
-            return f"Please correct the following Japanese text: {script_text}"
+            return "Please correct the Japanese text in the next message."
+        
+        # The script is sent in its own message, so drop the placeholder and its "***" separator.
+        # A template without the placeholder is used as instructions as a whole.
+        before, _, after = prompt_template.format(script_var="\0").partition("\0")
+        parts = [part.strip().strip("*").strip() for part in (before, after)]
+        return "\n\n".join(part for part in parts if part)
+
+    def build_system_prompt(self, context_path, prompt_path, extra_instruction=None):
+        """
+        Build (once) the static system message: context, then instructions.
+        Keeping it byte-identical across requests lets the provider cache the prompt prefix.
+        """
+        key = (context_path, prompt_path, extra_instruction)
+        if key not in self.system_prompts:
+            instructions, _, output_format = self.load_instructions(prompt_path).partition(OUTPUT_FORMAT_MARKER)
+            if not extra_instruction:
+                extra_instruction = output_format.strip()
+            parts = [self.load_context(context_path), instructions.strip(), extra_instruction]
+            self.system_prompts[key] = "\n\n".join(part for part in parts if part)
+        return self.system_prompts[key]
+
+    def request_correction(self, messages):
+        """Run the completion, requesting continuations until the response is complete"""
+        complete_response = ""
+        request_count = 0
+        
+        while request_count < self.max_requests:
+            request_count += 1
+            print(f"\n[Request {request_count}] Sending API request...")
+            
+            response = self.create_completion(messages)
+            
+            content = response.choices[0].message.content
+            complete_response += content
+            
+            print(f"[Request {request_count}] Received {len(content)} tokens.")
+            print(f"[Total tokens so far] {len(complete_response)} tokens collected.")
+            
+            # Check if response is complete
+            if len(content) < self.max_tokens * 0.8:
+                print(f"[Completed] Full response generated with {len(complete_response)} tokens.")
+                break
+            
+            # Add the latest response to message history
+            messages.append({"role": "assistant", "content": content})
+            print(f"[Request {request_count}] Continuing to request additional content...")
+        
+        if request_count >= self.max_requests:
+            print("[Warning] Maximum request count reached, response may be incomplete.")
+        
+        return complete_response
 
-    def correct_text(self, text, context_path, prompt_path):
+    def correct_text(self, text, context_path, prompt_path, deadline=None):
         """Correct Japanese text using ChatGPT"""
         print("\n[ChatGPT text correction started]")
+        self.deadline = deadline or Deadline()
         
-        context = self.load_context(context_path)
-        prompt = self.load_prompt(prompt_path, text)
+        self.reset_usage()
         
         messages = [
-            {"role": "system", "content": context},
-            {"role": "user", "content": prompt}
+            {"role": "system", "content": self.build_system_prompt(context_path, prompt_path)},
+            {"role": "user", "content": text}
         ]
         
-        complete_response = ""
-        request_count = 0
+        try:
+            corrected_text = self.request_correction(messages)
+            self.print_usage_summary()
+            return corrected_text
+            
+        except Exception as e:
+            print(f"Error in ChatGPT text correction: {str(e)}")
+            return None
+
+    def batch_indices(self, sentences, indices):
+        """Group sentence indices into batches of at most max_batch_chars characters"""
+        batches = []
+        current_batch = []
+        current_length = 0
+        
+        for index in indices:
+            length = len(sentences[index]["text"])
+            if current_batch and current_length + length > self.max_batch_chars:
+                batches.append(current_batch)
+                current_batch = []
+                current_length = 0
+            current_batch.append(index)
+            current_length += length
         
+        if current_batch:
+            batches.append(current_batch)
+        return batches
+
+    def parse_numbered_lines(self, response, indices):
+        """Map numbered response lines back to sentence indices"""
+        corrections = {}
+        for line in response.splitlines():
+            match = NUMBERED_LINE_PATTERN.match(line.strip())
+            if match and int(match.group(1)) in indices:
+                corrections[int(match.group(1))] = match.group(2).strip()
+        return corrections
+
+    def parse_edit_list(self, response, sentences, indices):
+        """Validate a JSON edit list and map it to sentence indices"""
         try:
-            while request_count < self.max_requests:
-                request_count += 1
-                print(f"\n[Request {request_count}] Sending API request...")
-                
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=messages,
-                    temperature=0.3,
-                    max_tokens=self.max_tokens
-                )
-                
-                content = response.choices[0].message.content
-                complete_response += content
-                
-                print(f"[Request {request_count}] Received {len(content)} tokens.")
-                print(f"[Total tokens so far] {len(complete_response)} tokens collected.")
-                
-                # Check if response is complete
-                if len(content) < self.max_tokens * 0.8:
-                    print(f"[Completed] Full response generated with {len(complete_response)} tokens.")
-                    break
-                
-                # Add the latest response to message history
-                messages.append({"role": "assistant", "content": content})
-                print(f"[Request {request_count}] Continuing to request additional content...")
+            edits = json.loads(response)["edits"]
+        except (json.JSONDecodeError, KeyError, TypeError) as e:
+            print(f"[Warning] Invalid edit list ({e}); keeping the original text for this batch.")
+            return {}
+        
+        corrections = {}
+        rejected = 0
+        for edit in edits if isinstance(edits, list) else []:
+            try:
+                index = int(edit["index"])
+                text = edit["text"].strip()
+            except (KeyError, TypeError, ValueError, AttributeError):
+                rejected += 1
+                continue
             
-            if request_count >= self.max_requests:
-                print("[Warning] Maximum request count reached, response may be incomplete.")
+            # Reject edits outside the batch and rewrites that drift too far from the original
+            if index not in indices or not text:
+                rejected += 1
+                continue
+            similarity = SequenceMatcher(None, sentences[index]["text"], text).ratio()
+            if similarity < self.min_edit_similarity:
+                rejected += 1
+                continue
+            corrections[index] = text
+        
+        if rejected:
+            print(f"[Warning] Rejected {rejected} invalid edits.")
+        return corrections
+
+    def format_batch(self, sentences, batch):
+        """Number the batch sentences and add their neighbours as read-only context lines"""
+        batch_indices = set(batch)
+        shown = set(batch)
+        for index in batch:
+            for offset in range(1, self.context_sentences + 1):
+                shown.update(neighbour for neighbour in (index - offset, index + offset)
+                             if 0 <= neighbour < len(sentences))
+        
+        lines = []
+        for index in sorted(shown):
+            if index in batch_indices:
+                lines.append(f"[{index}] {sentences[index]['text']}")
+            else:
+                lines.append(f"{CONTEXT_LINE_PREFIX} {sentences[index]['text']}")
+        return "\n".join(lines)
+
+    def correct_batch(self, sentences, batch, system_prompt):
+        """Correct one batch of sentences, returning {index: corrected text}"""
+        numbered_text = self.format_batch(sentences, batch)
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": numbered_text}
+        ]
+        
+        if self.correction_mode == "edits":
+            response = self.create_completion(
+                messages,
+                max_tokens=self.max_edit_tokens,
+                response_format={"type": "json_object"}
+            )
+            if response.choices[0].finish_reason == "length":
+                # A truncated edit list is not valid JSON: retry the halves separately
+                if len(batch) == 1:
+                    print(f"[Warning] Edit list for sentence {batch[0]} hit the token limit; "
+                          "keeping the original text.")
+                    return {}
+                middle = len(batch) // 2
+                print(f"[Edits] Edit list hit the token limit; splitting the batch of {len(batch)} sentences.")
+                corrections = self.correct_batch(sentences, batch[:middle], system_prompt)
+                corrections.update(self.correct_batch(sentences, batch[middle:], system_prompt))
+                return corrections
+            corrections = self.parse_edit_list(response.choices[0].message.content, sentences, set(batch))
+            print(f"[Edits] {len(corrections)} of {len(batch)} sentences corrected "
+                  f"({response.usage.completion_tokens} output tokens).")
+            return corrections
+        
+        corrections = self.parse_numbered_lines(self.request_correction(messages), set(batch))
+        if len(corrections) < len(batch):
+            print(f"[Warning] {len(batch) - len(corrections)} sentences missing from response; "
+                  "keeping the original text for those.")
+        return corrections
+
+    def correct_sentences(self, sentences, context_path, prompt_path, deadline=None, gate=None):
+        """Correct sentences (only those the gate flags, if given), merging results back in order"""
+        print("\n[ChatGPT sentence correction started]")
+        self.deadline = deadline or Deadline()
+        
+        instruction = EDIT_LIST_INSTRUCTION if self.correction_mode == "edits" else NUMBERED_LINES_INSTRUCTION
+        system_prompt = self.build_system_prompt(context_path, prompt_path, instruction)
+        self.reset_usage()
+        targets = gate.select(sentences) if gate else list(range(len(sentences)))
+        corrected = [sentence["text"] for sentence in sentences]
+        
+        try:
+            for batch in self.batch_indices(sentences, targets):
+                for index, text in self.correct_batch(sentences, batch, system_prompt).items():
+                    if text:
+                        corrected[index] = text
             
-            return complete_response
+            self.print_usage_summary()
+            return ' '.join(corrected)
             
         except Exception as e:
             print(f"Error in ChatGPT text correction: {str(e)}")
-            return None
\ No newline at end of file
+            return None
@@ -0,0 +1,158 @@
+"""
+Adaptive TTS chunk planning for VoiceTranslateFlow
+
+Tunes the target chunk length and the pause between batches per voice from
+observed synthesis latency and failures, and keeps what it learned between runs.
+"""
+
+import os
+import json
+
+from utils.rate_limiter import file_lock
+
+
+class ChunkPlanner:
+    def __init__(self, state_path, voice, initial_length=500, min_length=150, max_length=2000,
+                 initial_pause=3.0, max_pause=30.0, window_size=10, step=0.15, max_error_rate=0.1,
+                 min_timeout=30.0, timeout_factor=4.0):
+        self.state_path = state_path
+        self.voice = voice
+        self.min_length = min_length
+        self.max_length = max_length
+        self.max_pause = max_pause
+        self.window_size = window_size
+        self.step = step
+        self.max_error_rate = max_error_rate
+        self.min_timeout = min_timeout
+        self.timeout_factor = timeout_factor
+
+        learned = self.load_state().get(voice, {})
+        self.target_length = learned.get("target_length", initial_length)
+        self.batch_pause = learned.get("batch_pause", initial_pause)
+        self.direction = learned.get("direction", 1)
+        self.last_throughput = learned.get("throughput")
+        self.seconds_per_char = learned.get("seconds_per_char")
+        self.error_rate = learned.get("error_rate", 0.0)
+
+        self.reset_window()
+        self.batch_failures = 0
+
+    def load_state(self):
+        """Load learned parameters for all voices, or {} if there is no usable state file"""
+        if not self.state_path:
+            return {}
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, json.JSONDecodeError):
+            return {}
+
+    def save_state(self):
+        """Persist the learned parameters for this voice, warning instead of failing on errors"""
+        if not self.state_path:
+            return
+        try:
+            directory = os.path.dirname(self.state_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Re-read under the lock so concurrent runs keep each other's voices
+            with file_lock(self.state_path + ".lock"):
+                state = self.load_state()
+                state[self.voice] = {
+                    "target_length": self.target_length,
+                    "batch_pause": self.batch_pause,
+                    "direction": self.direction,
+                    "throughput": self.last_throughput,
+                    "seconds_per_char": self.seconds_per_char,
+                    "error_rate": self.error_rate,
+                }
+                tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as file:
+                    json.dump(state, file, indent=2)
+                os.replace(tmp_path, self.state_path)
+        except OSError as e:
+            print(f"Warning: could not save TTS planner state: {e}")
+
+    def reset_window(self):
+        """Start a new observation window for the next adaptation step"""
+        self.window_chunks = 0
+        self.window_failures = 0
+        self.window_chars = 0
+        self.window_seconds = 0.0
+
+    @staticmethod
+    def split_sentences(text):
+        """Split text into sentences, keeping the ". " boundaries the synthesizer has always used"""
+        return [sentence for sentence in text.split(". ") if sentence]
+
+    def request_timeout(self, chars, default):
+        """
+        Timeout for synthesizing `chars` characters: a multiple of the learned
+        per-character latency, never above `default` (used until latency is known)
+        """
+        if self.seconds_per_char is None:
+            return default
+        return min(default, max(self.min_timeout, self.timeout_factor * self.seconds_per_char * chars))
+
+    def next_chunk(self, sentences, start):
+        """Build the next chunk from sentences[start:] at the current target length"""
+        chunk = ""
+        index = start
+        while index < len(sentences):
+            sentence = sentences[index] + ". "
+            # Always take at least one sentence, even if it exceeds the target
+            if chunk and len(chunk) + len(sentence) > self.target_length:
+                break
+            chunk += sentence
+            index += 1
+        return chunk.strip(), index
+
+    def record(self, chars, seconds, success):
+        """Record one synthesis call and adapt once a full window has been observed"""
+        self.window_chunks += 1
+        self.window_seconds += seconds
+        if success:
+            self.window_chars += chars
+            per_char = seconds / max(chars, 1)
+            self.seconds_per_char = per_char if self.seconds_per_char is None else (
+                0.8 * self.seconds_per_char + 0.2 * per_char
+            )
+        else:
+            self.window_failures += 1
+            self.batch_failures += 1
+
+        if self.window_chunks >= self.window_size:
+            self.adapt()
+
+    def adapt(self):
+        """Hill-climb the target length towards the best successful characters per second"""
+        error_rate = self.window_failures / self.window_chunks
+        throughput = self.window_chars / self.window_seconds if self.window_seconds else 0.0
+        self.error_rate = 0.7 * self.error_rate + 0.3 * error_rate
+
+        if self.error_rate > self.max_error_rate:
+            # Large chunks keep timing out or getting rejected: back off hard
+            self.direction = -1
+            factor = 1 - 2 * self.step
+        else:
+            if self.last_throughput is not None and throughput < self.last_throughput:
+                self.direction = -self.direction
+            factor = 1 + self.direction * self.step
+        self.last_throughput = throughput
+
+        previous_length = self.target_length
+        self.target_length = int(min(self.max_length, max(self.min_length, self.target_length * factor)))
+        print(f"[Planner] {throughput:.1f} chars/s, {error_rate * 100:.0f}% failures; "
+              f"chunk length {previous_length} -> {self.target_length}")
+
+        self.reset_window()
+        self.save_state()
+
+    def end_batch(self):
+        """Return the pause before the next batch, widening it after failures"""
+        if self.batch_failures:
+            self.batch_pause = min(self.max_pause, max(1.0, self.batch_pause * 2))
+        else:
+            self.batch_pause = self.batch_pause / 2 if self.batch_pause > 0.5 else 0.0
+        self.batch_failures = 0
+        return self.batch_pause
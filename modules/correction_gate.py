@@ -0,0 +1,88 @@
+"""
+Sentence gating for ChatGPT text correction in VoiceTranslateFlow
+
+Decides which transcribed sentences are worth sending to the model, using the
+ASR confidence when SpeechFlow reports it and cheap local heuristics for the
+sentences it does not cover. Without any confidence every sentence is sent: the
+heuristics cannot see homophone, particle or grammar mistakes.
+"""
+
+import re
+
+
+# Katakana words and Latin/alphanumeric tokens are where ASR mistakes on
+# technical terms and proper nouns usually show up
+TERM_PATTERN = re.compile(r"[ァ-ヺー]{2,}|[A-Za-z][A-Za-z0-9\-]+")
+
+# The same 2+ character fragment repeated back to back (stutters, ASR loops)
+REPEAT_PATTERN = re.compile(r"(.{2,})\1{2,}")
+
+FILLERS = ("えー", "あー", "あのー", "えっと", "そのー", "まあ")
+
+# Everyday loanwords that are not worth a correction request on their own
+COMMON_LOANWORDS = frozenset((
+    "データ", "テスト", "プレゼンテーション", "プレゼン", "システム", "サービス", "ユーザー",
+    "サーバー", "ファイル", "メール", "ミーティング", "プロジェクト", "チーム", "スケジュール",
+    "コスト", "リスク", "ポイント", "レベル", "タイプ", "モデル", "ツール", "ページ", "サイト",
+    "ネット", "インターネット", "アプリ", "ソフト", "パソコン", "スマホ", "ビジネス", "マーケティング",
+    "コミュニケーション", "イベント", "ニュース", "テーマ", "グループ", "メンバー", "リスト",
+    "バージョン", "エラー", "セキュリティ", "コンテンツ", "プログラム", "ソフトウェア", "クラウド",
+))
+
+
+class CorrectionGate:
+    def __init__(self, context="", confidence_threshold=0.85, unknown_term_ratio=0.5,
+                 max_fillers=2):
+        self.confidence_threshold = confidence_threshold
+        self.unknown_term_ratio = unknown_term_ratio
+        self.max_fillers = max_fillers
+        self.known_terms = set(TERM_PATTERN.findall(context))
+        self.context = context
+
+    def is_known_term(self, term):
+        return term in COMMON_LOANWORDS or term in self.known_terms or term in self.context
+
+    def suspicion_reason(self, sentence):
+        """Return why a sentence needs correction, or None if it looks clean"""
+        text = sentence["text"]
+        confidence = sentence.get("confidence")
+
+        if confidence is not None:
+            # The ASR's own confidence beats the heuristics below whenever it is reported
+            return "low confidence" if confidence < self.confidence_threshold else None
+
+        terms = TERM_PATTERN.findall(text)
+        if terms:
+            unknown = [term for term in terms if not self.is_known_term(term)]
+            if len(unknown) / len(terms) >= self.unknown_term_ratio:
+                return "unknown terms"
+
+        if REPEAT_PATTERN.search(text):
+            return "repetition"
+
+        if sum(text.count(filler) for filler in FILLERS) > self.max_fillers:
+            return "fillers"
+
+        return None
+
+    def select(self, sentences):
+        """Return the indices of sentences that should be sent for correction"""
+        if all(sentence.get("confidence") is None for sentence in sentences):
+            print("[Gate] The transcript reports no confidence; sending every sentence for correction")
+            return list(range(len(sentences)))
+        
+        suspects = []
+        reasons = {}
+        for index, sentence in enumerate(sentences):
+            reason = self.suspicion_reason(sentence)
+            if reason:
+                suspects.append(index)
+                reasons[reason] = reasons.get(reason, 0) + 1
+
+        total_chars = sum(len(sentence["text"]) for sentence in sentences)
+        suspect_chars = sum(len(sentences[index]["text"]) for index in suspects)
+        print(f"[Gate] {len(suspects)} / {len(sentences)} sentences need correction "
+              f"({suspect_chars} / {total_chars} characters)")
+        if reasons:
+            print("[Gate] Reasons: " + ", ".join(f"{reason}={count}" for reason, count in reasons.items()))
+        return suspects
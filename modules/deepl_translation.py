@@ -2,16 +2,80 @@
 DeepL translation module for VoiceTranslateFlow
 """
 
+import time
 import deepl
+from utils.latency import Deadline, hedged_call
+
+
+# Latency is tracked per chunk size class: per-character figures hide the fixed cost of a call
+CHUNK_SIZE_CLASSES = (500, 1000, 2000, 5000)
 
 
 class DeepLTranslator:
-    def __init__(self, auth_key, target_lang="EN-US", max_chunk_size=50000):
+    def __init__(self, auth_key, target_lang="EN-US", max_chunk_size=5000, rate_limiter=None,
+                 max_rate_limit_retries=3, latency_tracker=None, request_timeout=120,
+                 hedge_max_chars=2000):
         self.auth_key = auth_key
         self.target_lang = target_lang
         self.max_chunk_size = max_chunk_size
+        self.rate_limiter = rate_limiter
+        self.max_rate_limit_retries = max_rate_limit_retries
+        self.latency_tracker = latency_tracker
+        self.request_timeout = request_timeout
+        self.hedge_max_chars = hedge_max_chars
+        self.hedged_chars = 0
+        self.deadline = Deadline()
         self.translator = deepl.Translator(auth_key)
 
+    def translate_chunk(self, chunk):
+        """
+        Translate a chunk within the request timeout and deadline, hedging with a
+        duplicate request if it is slower than usual. DeepL bills the duplicate too,
+        so only chunks up to hedge_max_chars are hedged (0 disables hedging).
+        """
+        delay = None
+        if self.latency_tracker and len(chunk) <= self.hedge_max_chars:
+            delay = self.latency_tracker.hedge_delay(self.latency_operation(chunk))
+        
+        def count_hedge():
+            self.hedged_chars += len(chunk)
+        
+        # The DeepL client has no per-call timeout, so bound the wait here
+        return hedged_call(
+            lambda: self.request_translation(chunk),
+            delay,
+            self.deadline,
+            timeout=self.request_timeout,
+            on_hedge=count_hedge
+        )
+
+    @staticmethod
+    def latency_operation(chunk):
+        """Latency histogram name for the size class of a chunk"""
+        for size_class in CHUNK_SIZE_CLASSES:
+            if len(chunk) <= size_class:
+                return f"deepl.translate.{size_class}"
+        return "deepl.translate.max"
+
+    def request_translation(self, chunk):
+        """Translate a single chunk through the shared rate limiter"""
+        attempt = 0
+        while True:
+            self.deadline.timeout(None)
+            if self.rate_limiter:
+                self.rate_limiter.acquire("deepl", chars=len(chunk))
+            start_time = time.monotonic()
+            try:
+                result = self.translator.translate_text(chunk, target_lang=self.target_lang)
+                if self.latency_tracker:
+                    self.latency_tracker.record(self.latency_operation(chunk), time.monotonic() - start_time)
+                return result.text
+            except deepl.TooManyRequestsException:
+                attempt += 1
+                if not self.rate_limiter or attempt > self.max_rate_limit_retries:
+                    raise
+                self.rate_limiter.record_rate_limited("deepl")
+
     def split_text(self, text):
         """Split text into chunks for translation"""
         chunks = []
@@ -31,9 +95,11 @@ class DeepLTranslator:
         
         return chunks
 
-    def translate(self, text):
+    def translate(self, text, deadline=None):
         """Translate Japanese text to English"""
         print("\n[Translation started]")
+        self.deadline = deadline or Deadline()
+        self.hedged_chars = 0
         
         if not text:
             print("No text to translate")
@@ -46,8 +112,7 @@ class DeepLTranslator:
         try:
             for chunk in chunks:
                 if chunk.strip():  # Skip empty chunks
-                    result = self.translator.translate_text(chunk, target_lang=self.target_lang)
-                    translated_texts.append(result.text)
+                    translated_texts.append(self.translate_chunk(chunk))
                     
                     translated_chars += len(chunk)
                     print(f"Translated {translated_chars} / {len(text)} characters")
@@ -56,6 +121,8 @@ class DeepLTranslator:
             
             final_translation = ''.join(translated_texts)
             print(f"Translation completed. Output length: {len(final_translation)} characters")
+            if self.hedged_chars:
+                print(f"Hedged duplicates billed an extra {self.hedged_chars} characters")
             return final_translation
             
         except Exception as e:
@@ -3,43 +3,87 @@ Genny text-to-speech synthesis module for VoiceTranslateFlow
 """
 
 import os
+import math
 import time
+import multiprocessing
 from io import BytesIO
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
 import requests
 from pydub import AudioSegment
+from modules.chunk_planner import ChunkPlanner
+from utils.latency import Deadline, DeadlineExceeded, hedged_call
+
+
+# Export arguments passed to pydub/ffmpeg for each supported output format
+AUDIO_FORMATS = {
+    "wav": {"format": "wav"},
+    "flac": {"format": "flac"},
+    "mp3": {"format": "mp3", "bitrate": "128k"},
+    "opus": {"format": "opus", "codec": "libopus", "bitrate": "48k"},
+}
+
+
+def encode_audio(raw_data, sample_width, frame_rate, channels, filepath, export_args):
+    """Encode raw PCM data to a file (runs in a worker process)"""
+    audio = AudioSegment(
+        data=raw_data,
+        sample_width=sample_width,
+        frame_rate=frame_rate,
+        channels=channels
+    )
+    audio.export(filepath, **export_args)
+    return filepath
 
 
 class GennySynthesizer:
-    def __init__(self, api_url, api_key, speaker, speaker_style, output_dir="./output"):
+    def __init__(self, api_url, api_key, speaker, speaker_style, output_dir="./output",
+                 audio_format="wav", audio_bitrate=None, encode_workers=2, rate_limiter=None,
+                 max_rate_limit_retries=3, request_timeout=120, latency_tracker=None,
+                 chunk_planner=None, segment_chars=40000, max_timeout_retries=2):
         self.api_url = api_url
         self.api_key = api_key
         self.speaker = speaker
         self.speaker_style = speaker_style
         self.output_dir = output_dir
+        
+        if audio_format not in AUDIO_FORMATS:
+            raise ValueError(
+                f"Unsupported audio format: {audio_format} "
+                f"(supported: {', '.join(AUDIO_FORMATS)})"
+            )
+        self.audio_format = audio_format
+        self.export_args = dict(AUDIO_FORMATS[audio_format])
+        if audio_bitrate and audio_format != "wav":
+            self.export_args["bitrate"] = audio_bitrate
+        self.encode_workers = encode_workers
+        self.rate_limiter = rate_limiter
+        self.max_rate_limit_retries = max_rate_limit_retries
+        self.request_timeout = request_timeout
+        self.latency_tracker = latency_tracker
+        self.chunk_planner = chunk_planner or ChunkPlanner(None, f"{speaker}:{speaker_style}")
+        self.segment_chars = segment_chars
+        self.max_timeout_retries = max_timeout_retries
+        self.deadline = Deadline()
+        self.encode_pool = None
+        self.pending_encodes = []
         self.headers = {
             'Accept': 'application/json',
             'X-Api-Key': api_key,
             'Content-Type': 'application/json'
         }
 
-    def split_text(self, text, max_length=500):
-        """Split text into chunks within the specified maximum length"""
-        chunks = []
-        current_chunk = ""
-        
-        for sentence in text.split(". "):
-            if len(current_chunk) + len(sentence) + 1 <= max_length:
-                current_chunk += sentence + ". "
-            else:
-                if current_chunk:
-                    chunks.append(current_chunk.strip())
-                current_chunk = sentence + ". "
-        
-        if current_chunk:
-            chunks.append(current_chunk.strip())
+    def download_audio(self, audio_url):
+        """Download synthesized audio, hedging with a duplicate request if it is slower than usual"""
+        def fetch():
+            start_time = time.monotonic()
+            response = requests.get(audio_url, timeout=self.deadline.timeout(self.request_timeout))
+            if self.latency_tracker:
+                self.latency_tracker.record("genny.download", time.monotonic() - start_time)
+            return response
         
-        return chunks
+        delay = self.latency_tracker.hedge_delay("genny.download") if self.latency_tracker else None
+        return hedged_call(fetch, delay, self.deadline)
 
     def synthesize_chunk(self, text_chunk, chunk_index, total_chunks):
         """Convert a text chunk to audio using the synthesis API"""
@@ -53,14 +97,32 @@ class GennySynthesizer:
         print(f"[{chunk_index + 1}/{total_chunks}] Synthesizing chunk...")
         
         try:
-            response = requests.post(self.api_url, headers=self.headers, json=data)
+            attempt = 0
+            while True:
+                if self.rate_limiter:
+                    self.rate_limiter.acquire("genny", chars=len(text_chunk))
+                timeout = self.deadline.timeout(
+                    self.chunk_planner.request_timeout(len(text_chunk), self.request_timeout)
+                )
+                start_time = time.monotonic()
+                response = requests.post(self.api_url, headers=self.headers, json=data, timeout=timeout)
+                if self.latency_tracker:
+                    self.latency_tracker.record("genny.synthesize", time.monotonic() - start_time)
+                if not self.rate_limiter:
+                    break
+                if response.status_code == 429 and attempt < self.max_rate_limit_retries:
+                    attempt += 1
+                    self.rate_limiter.record_rate_limited("genny", response.headers)
+                    continue
+                self.rate_limiter.update_from_headers("genny", response.headers)
+                break
             
             if response.status_code in [200, 201]:
                 response_json = response.json()
                 
                 if "data" in response_json and response_json["data"] and "urls" in response_json["data"][0]:
                     audio_url = response_json["data"][0]["urls"][0]
-                    audio_response = requests.get(audio_url)
+                    audio_response = self.download_audio(audio_url)
                     
                     if audio_response.status_code == 200:
                         print(f"[{chunk_index + 1}/{total_chunks}] Chunk synthesis succeeded.")
@@ -74,11 +136,34 @@ class GennySynthesizer:
             else:
                 print(f"[{chunk_index + 1}/{total_chunks}] Failed to synthesize text. Status code: {response.status_code}")
                 return None
-                
+        
+        except (DeadlineExceeded, requests.Timeout):
+            raise
         except Exception as e:
             print(f"[{chunk_index + 1}/{total_chunks}] Error in synthesis: {str(e)}")
             return None
 
+    def synthesize_with_retries(self, text_chunk, chunk_index, total_chunks):
+        """
+        Synthesize a chunk, retrying it after a request timeout while the deadline
+        allows. A chunk that keeps timing out fails the run rather than leaving a gap.
+        """
+        for attempt in range(self.max_timeout_retries + 1):
+            start_time = time.monotonic()
+            try:
+                audio_segment = self.synthesize_chunk(text_chunk, chunk_index, total_chunks)
+            except requests.Timeout as e:
+                self.chunk_planner.record(len(text_chunk), time.monotonic() - start_time, False)
+                if attempt == self.max_timeout_retries:
+                    raise RuntimeError(
+                        f"Chunk {chunk_index + 1} timed out {attempt + 1} times; giving up"
+                    ) from e
+                print(f"[{chunk_index + 1}/{total_chunks}] Request timed out; retrying chunk...")
+                continue
+            
+            self.chunk_planner.record(len(text_chunk), time.monotonic() - start_time, audio_segment is not None)
+            return audio_segment
+
     def concatenate_audios(self, audio_segments):
         """Concatenate multiple audio segments into one"""
         combined_audio = AudioSegment.empty()
@@ -88,11 +173,52 @@ class GennySynthesizer:
         return combined_audio
 
     def save_audio(self, audio, filename):
-        """Save audio file to output directory"""
+        """Save audio file to output directory, encoding in the background when possible"""
         os.makedirs(self.output_dir, exist_ok=True)
         filepath = os.path.join(self.output_dir, filename)
-        audio.export(filepath, format="wav")
-        print(f"Audio file saved as {filepath}")
+        
+        # WAV is a plain copy of the PCM data, so a worker process would only add pickling cost
+        if self.encode_workers <= 0 or self.audio_format == "wav":
+            audio.export(filepath, **self.export_args)
+            print(f"Audio file saved as {filepath}")
+            return
+        
+        if self.encode_pool is None:
+            # Hedged requests may still be running in threads; forking them could deadlock a worker
+            self.encode_pool = ProcessPoolExecutor(
+                max_workers=self.encode_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        
+        future = self.encode_pool.submit(
+            encode_audio,
+            audio.raw_data,
+            audio.sample_width,
+            audio.frame_rate,
+            audio.channels,
+            filepath,
+            self.export_args
+        )
+        self.pending_encodes.append(future)
+        print(f"Audio file queued for {self.audio_format} encoding: {filepath}")
+
+    def wait_for_encoding(self):
+        """Wait for all queued audio encodes to finish, raising if any of them failed"""
+        failures = []
+        for future in self.pending_encodes:
+            try:
+                print(f"Audio file saved as {future.result()}")
+            except Exception as e:
+                print(f"Error encoding audio file: {str(e)}")
+                failures.append(e)
+        self.pending_encodes = []
+        
+        if self.encode_pool is not None:
+            self.encode_pool.shutdown()
+            self.encode_pool = None
+        
+        if failures:
+            raise RuntimeError(f"{len(failures)} audio file(s) failed to encode") from failures[0]
 
     def save_script(self, script, filename):
         """Save script text to output directory"""
@@ -102,9 +228,10 @@ class GennySynthesizer:
             file.write(script)
         print(f"Script file saved as {filepath}")
 
-    def synthesize(self, text, timestamp=None):
+    def synthesize(self, text, timestamp=None, deadline=None):
         """Main synthesis function"""
         print("\n[Text-to-speech process started]")
+        self.deadline = deadline or Deadline()
         
         if not text:
             print("No text to synthesize")
@@ -113,36 +240,59 @@ class GennySynthesizer:
         if timestamp is None:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         
-        text_chunks = self.split_text(text)
-        total_chunks = len(text_chunks)
+        sentences = self.chunk_planner.split_sentences(text)
+        remaining_chars = sum(len(sentence) + 2 for sentence in sentences)
         audio_segments = []
         script_content_en = ""
+        segment_chars = 0
         file_index = 1
+        chunk_index = 0
+        sentence_index = 0
         
-        for i, chunk in enumerate(text_chunks):
-            print(f"Processing chunk {i + 1} of {total_chunks}")
-            
-            audio_segment = self.synthesize_chunk(chunk, i, total_chunks)
-            if audio_segment:
-                audio_segments.append(audio_segment)
-                script_content_en += f"{chunk}\n\n"
-            else:
-                print(f"Skipping chunk {i + 1} due to synthesis failure.")
-            
-            # Save files every 80 chunks or at the end
-            if (i + 1) % 80 == 0 or (i + 1) == total_chunks:
-                if audio_segments:
-                    combined_audio_en = self.concatenate_audios(audio_segments)
-                    audio_filename = f"en_audio{file_index}_{timestamp}.wav"
-                    self.save_audio(combined_audio_en, audio_filename)
-                    audio_segments = []
+        try:
+            while sentence_index < len(sentences):
+                chunk, sentence_index = self.chunk_planner.next_chunk(sentences, sentence_index)
+                remaining_chars -= len(chunk)
+                estimated_chunks = chunk_index + 1 + math.ceil(
+                    max(remaining_chars, 0) / self.chunk_planner.target_length
+                )
+                print(f"Processing chunk {chunk_index + 1} of ~{estimated_chunks} "
+                      f"({len(chunk)} characters)")
+                
+                audio_segment = self.synthesize_with_retries(chunk, chunk_index, estimated_chunks)
+                
+                if audio_segment:
+                    audio_segments.append(audio_segment)
+                    script_content_en += f"{chunk}\n\n"
+                else:
+                    print(f"Skipping chunk {chunk_index + 1} due to synthesis failure.")
                 
-                if script_content_en:
-                    script_filename_en = f"en_script{file_index}_{timestamp}.txt"
-                    self.save_script(script_content_en, script_filename_en)
-                    script_content_en = ""
+                chunk_index += 1
+                segment_chars += len(chunk)
+                is_last = sentence_index >= len(sentences)
                 
-                file_index += 1
-                time.sleep(3)  # Wait before the next batch
+                # Save files every segment_chars characters (about 20 minutes of audio) or at the end
+                if segment_chars >= self.segment_chars or is_last:
+                    if audio_segments:
+                        combined_audio_en = self.concatenate_audios(audio_segments)
+                        audio_filename = f"en_audio{file_index}_{timestamp}.{self.audio_format}"
+                        self.save_audio(combined_audio_en, audio_filename)
+                        audio_segments = []
+                    
+                    if script_content_en:
+                        script_filename_en = f"en_script{file_index}_{timestamp}.txt"
+                        self.save_script(script_content_en, script_filename_en)
+                        script_content_en = ""
+                    
+                    file_index += 1
+                    segment_chars = 0
+                    pause = self.chunk_planner.end_batch()
+                    if pause and not is_last:
+                        time.sleep(pause)  # Wait before the next batch
+            
+            self.chunk_planner.save_state()
+        finally:
+            # Let queued encodes finish even if synthesis stops early
+            self.wait_for_encoding()
         
         print("Text-to-speech synthesis completed!")
\ No newline at end of file
@@ -2,22 +2,57 @@
 SpeechFlow transcription module for VoiceTranslateFlow
 """
 
+import os
 import json
 import time
 import requests
+from utils.latency import Deadline
 
 
 class SpeechFlowTranscriber:
-    def __init__(self, api_key_id, api_key_secret, lang="ja", result_type=1):
+    def __init__(self, api_key_id, api_key_secret, lang="ja", result_type=1, rate_limiter=None,
+                 max_rate_limit_retries=3, request_timeout=120, poll_interval=5, latency_tracker=None,
+                 transcript_cache=None):
         self.api_key_id = api_key_id
         self.api_key_secret = api_key_secret
         self.lang = lang
         self.result_type = result_type
+        self.rate_limiter = rate_limiter
+        self.max_rate_limit_retries = max_rate_limit_retries
+        self.request_timeout = request_timeout
+        self.poll_interval = poll_interval
+        self.latency_tracker = latency_tracker
+        self.transcript_cache = transcript_cache
+        self.deadline = Deadline()
         self.headers = {
             "keyId": self.api_key_id,
             "keySecret": self.api_key_secret
         }
         self.query_result = None
+        self.sentences = []
+        self.cache_hit = False
+
+    def send_request(self, method, url, **kwargs):
+        """Send an API request through the shared rate limiter, waiting out 429 responses"""
+        attempt = 0
+        while True:
+            if self.rate_limiter:
+                self.rate_limiter.acquire("speechflow")
+            for file in kwargs.get("files", {}).values():
+                file.seek(0)
+            timeout = self.deadline.timeout(self.request_timeout)
+            start_time = time.monotonic()
+            response = requests.request(method, url, timeout=timeout, **kwargs)
+            if self.latency_tracker:
+                self.latency_tracker.record(f"speechflow.{method.lower()}", time.monotonic() - start_time)
+            if not self.rate_limiter:
+                return response
+            if response.status_code == 429 and attempt < self.max_rate_limit_retries:
+                attempt += 1
+                self.rate_limiter.record_rate_limited("speechflow", response.headers)
+                continue
+            self.rate_limiter.update_from_headers("speechflow", response.headers)
+            return response
 
     def create_task(self, file_path):
         """Create a transcription task"""
@@ -27,13 +62,13 @@ class SpeechFlowTranscriber:
         if file_path.startswith('http'):
             create_data['remotePath'] = file_path
             print('Submitting a remote file')
-            response = requests.post(create_url, data=create_data, headers=self.headers)
+            response = self.send_request("POST", create_url, data=create_data, headers=self.headers)
         else:
             print('Submitting a local file')
             create_url += f"?lang={self.lang}"
             with open(file_path, "rb") as file:
                 files = {'file': file}
-                response = requests.post(create_url, headers=self.headers, files=files)
+                response = self.send_request("POST", create_url, headers=self.headers, files=files)
         
         if response.status_code == 200:
             create_result = response.json()
@@ -53,7 +88,7 @@ class SpeechFlowTranscriber:
         print('Querying transcription result')
         
         while True:
-            response = requests.get(query_url, headers=self.headers)
+            response = self.send_request("GET", query_url, headers=self.headers)
             if response.status_code == 200:
                 self.query_result = response.json()
                 if self.query_result["code"] == 11000:
@@ -61,7 +96,8 @@ class SpeechFlowTranscriber:
                     return self.query_result
                 elif self.query_result["code"] == 11001:
                     print('Waiting for transcription...')
-                    time.sleep(5)
+                    remaining = self.deadline.remaining()
+                    time.sleep(self.poll_interval if remaining is None else min(self.poll_interval, remaining))
                     continue
                 else:
                     print("Transcription error:", self.query_result['msg'])
@@ -70,22 +106,76 @@ class SpeechFlowTranscriber:
                 print('Query request failed:', response.status_code)
                 return None
 
-    def extract_text(self, result):
-        """Extract text from transcription result"""
+    def sentence_confidence(self, sentence):
+        """Sentence confidence from the result, averaging word confidences if needed"""
+        for key in ("confidence", "conf"):
+            if key in sentence:
+                return float(sentence[key])
+        
+        word_scores = [
+            float(word[key])
+            for word in sentence.get("words", [])
+            for key in ("confidence", "conf")
+            if key in word
+        ]
+        if word_scores:
+            return sum(word_scores) / len(word_scores)
+        return None
+
+    def extract_sentences(self, result):
+        """Extract sentences with their confidence (None when not reported)"""
         if not result or 'result' not in result:
-            return ""
+            return []
         
         try:
             sentences = json.loads(result['result'])['sentences']
-            transcription_texts = [sentence['s'] for sentence in sentences]
-            return ' '.join(transcription_texts)
-        except (json.JSONDecodeError, KeyError) as e:
+            return [
+                {"text": sentence['s'], "confidence": self.sentence_confidence(sentence)}
+                for sentence in sentences
+            ]
+        except (json.JSONDecodeError, KeyError, TypeError, ValueError) as e:
             print(f"Error extracting text: {e}")
-            return ""
+            return []
 
-    def transcribe(self, file_path):
+    def extract_text(self, result):
+        """Extract text from transcription result"""
+        self.sentences = self.extract_sentences(result)
+        return ' '.join(sentence["text"] for sentence in self.sentences)
+
+    def record_cache_lookup(self, hit, upload_bytes=0):
+        """Update transcript cache statistics, warning instead of failing on errors"""
+        try:
+            self.transcript_cache.record(hit, upload_bytes)
+        except Exception as e:
+            print(f"Warning: could not update transcript cache statistics: {e}")
+
+    def transcribe(self, file_path, deadline=None):
         """Complete transcription process"""
         print("\n[Transcription started]")
+        self.deadline = deadline or Deadline()
+        self.sentences = []
+        self.cache_hit = False
+        
+        cache_key = None
+        if self.transcript_cache:
+            try:
+                cache_key = self.transcript_cache.key_for(file_path, self.lang, self.result_type, self.deadline)
+                cached = self.transcript_cache.load(cache_key)
+            except Exception as e:
+                print(f"Transcript cache unavailable: {e}")
+                cached = None
+            
+            if cached:
+                upload_bytes = 0 if file_path.startswith('http') else os.path.getsize(file_path)
+                self.record_cache_lookup(True, upload_bytes)
+                print(f"Using cached transcript from task {cached['task'].get('task_id')}")
+                self.query_result = cached["result"]
+                self.cache_hit = True
+                text = self.extract_text(self.query_result)
+                print(f"Transcription completed. Text length: {len(text)} characters")
+                return text
+            elif cache_key:
+                self.record_cache_lookup(False)
         
         task_id = self.create_task(file_path)
         if not task_id:
@@ -95,6 +185,18 @@ class SpeechFlowTranscriber:
         if not result:
             return None
         
+        if cache_key:
+            # A transcript that cannot be cached is still a good transcript
+            try:
+                self.transcript_cache.store(cache_key, result, {
+                    "task_id": task_id,
+                    "source": file_path,
+                    "lang": self.lang,
+                    "result_type": self.result_type,
+                })
+            except Exception as e:
+                print(f"Warning: could not store transcript in cache: {e}")
+        
         text = self.extract_text(result)
         print(f"Transcription completed. Text length: {len(text)} characters")
         return text
\ No newline at end of file
@@ -0,0 +1,238 @@
+"""
+Pre-run time and cost estimation for VoiceTranslateFlow
+
+Forecasts wall time, API spend and peak memory per stage from the media
+duration and per-stage throughput learned from past runs, and reports how far
+each forecast was off once the run finishes.
+"""
+
+import os
+import json
+import time
+
+from utils.rate_limiter import file_lock
+
+
+# Starting points until a few runs have been recorded
+DEFAULT_RATES = {
+    "jp_chars_per_audio_minute": 300.0,
+    "asr_seconds_per_audio_minute": 15.0,
+    "correction_input_tokens_per_char": 1.5,
+    "correction_output_tokens_per_char": 0.3,
+    "correction_seconds_per_char": 0.01,
+    "deepl_chars_per_second": 2000.0,
+    "en_chars_per_jp_char": 2.0,
+    "tts_seconds_per_char": 0.02,
+}
+
+STAGES = ("transcription", "correction", "translation", "synthesis")
+
+# Synthesized speech: about 15 characters per second of 24 kHz 16-bit mono PCM
+EN_CHARS_PER_AUDIO_SECOND = 15.0
+PCM_BYTES_PER_SECOND = 24000 * 2
+
+BASE_MEMORY_MB = 80.0
+MAX_HISTORY_RUNS = 50
+
+
+class PerformanceHistory:
+    def __init__(self, path, smoothing=0.3):
+        self.path = path
+        self.smoothing = smoothing
+        self.data = self.load()
+        # Measurements and runs of this process, merged into the file on save
+        self.pending_rates = []
+        self.pending_runs = []
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            data = {}
+        data.setdefault("rates", {})
+        data.setdefault("runs", [])
+        return data
+
+    def save(self):
+        """Merge this process's measurements and runs into the file written by other runs"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with file_lock(self.path + ".lock"):
+            self.data = self.load()
+            for name, value in self.pending_rates:
+                self.blend_rate(name, value)
+            self.data["runs"] = (self.data["runs"] + self.pending_runs)[-MAX_HISTORY_RUNS:]
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                json.dump(self.data, file, indent=2)
+            os.replace(tmp_path, self.path)
+        self.pending_rates = []
+        self.pending_runs = []
+
+    def rate(self, name):
+        return self.data["rates"].get(name, DEFAULT_RATES[name])
+
+    def update_rate(self, name, value):
+        """Blend a newly measured rate into the stored average"""
+        if value is None or value <= 0:
+            return
+        self.pending_rates.append((name, value))
+        self.blend_rate(name, value)
+
+    def add_run(self, run):
+        """Record a finished run"""
+        self.pending_runs.append(run)
+        self.data["runs"] = (self.data["runs"] + [run])[-MAX_HISTORY_RUNS:]
+
+    def blend_rate(self, name, value):
+        if name not in self.data["rates"]:
+            self.data["rates"][name] = value
+        else:
+            previous = self.data["rates"][name]
+            self.data["rates"][name] = (1 - self.smoothing) * previous + self.smoothing * value
+
+
+class Estimator:
+    def __init__(self, history, prices, segment_chars=40000):
+        """
+        prices: {"speechflow_per_hour", "openai_input_per_million", "openai_output_per_million",
+                 "deepl_per_million_chars", "genny_per_million_chars"}
+        """
+        self.history = history
+        self.prices = prices
+        self.segment_chars = segment_chars
+
+    def forecast(self, duration_seconds, file_size=0):
+        """Forecast seconds, cost and peak memory (MB) per stage for a media file"""
+        rate = self.history.rate
+        minutes = duration_seconds / 60
+        jp_chars = minutes * rate("jp_chars_per_audio_minute")
+        input_tokens = jp_chars * rate("correction_input_tokens_per_char")
+        output_tokens = jp_chars * rate("correction_output_tokens_per_char")
+        en_chars = jp_chars * rate("en_chars_per_jp_char")
+
+        # Audio for one output part is held as raw PCM, concatenated, and copied to the encoder
+        part_seconds = min(en_chars, self.segment_chars) / EN_CHARS_PER_AUDIO_SECOND
+        part_audio_mb = part_seconds * PCM_BYTES_PER_SECOND / (1024 * 1024)
+
+        stages = {
+            "transcription": {
+                "seconds": minutes * rate("asr_seconds_per_audio_minute"),
+                "cost": minutes / 60 * self.prices["speechflow_per_hour"],
+                # Local uploads are encoded into a multipart body in memory
+                "peak_memory_mb": BASE_MEMORY_MB + file_size / (1024 * 1024),
+            },
+            "correction": {
+                "seconds": jp_chars * rate("correction_seconds_per_char"),
+                "cost": (input_tokens * self.prices["openai_input_per_million"]
+                         + output_tokens * self.prices["openai_output_per_million"]) / 1e6,
+                "peak_memory_mb": BASE_MEMORY_MB,
+            },
+            "translation": {
+                "seconds": jp_chars / rate("deepl_chars_per_second"),
+                "cost": jp_chars * self.prices["deepl_per_million_chars"] / 1e6,
+                "peak_memory_mb": BASE_MEMORY_MB,
+            },
+            "synthesis": {
+                "seconds": en_chars * rate("tts_seconds_per_char"),
+                "cost": en_chars * self.prices["genny_per_million_chars"] / 1e6,
+                "peak_memory_mb": BASE_MEMORY_MB + 3 * part_audio_mb,
+            },
+        }
+        return {
+            "duration_seconds": duration_seconds,
+            "jp_chars": jp_chars,
+            "en_chars": en_chars,
+            "stages": stages,
+            "total_seconds": sum(stage["seconds"] for stage in stages.values()),
+            "total_cost": sum(stage["cost"] for stage in stages.values()),
+            "peak_memory_mb": max(stage["peak_memory_mb"] for stage in stages.values()),
+        }
+
+    def record_run(self, forecast, actual):
+        """
+        Learn from a finished run and report forecast error per stage.
+        actual: {"duration_seconds", "jp_chars", "en_chars", "input_tokens", "output_tokens",
+                 "transcript_cached", "stage_seconds": {stage: seconds}}
+        """
+        minutes = actual["duration_seconds"] / 60
+        jp_chars = actual["jp_chars"]
+        en_chars = actual["en_chars"]
+        seconds = actual["stage_seconds"]
+        update = self.history.update_rate
+
+        if minutes > 0:
+            update("jp_chars_per_audio_minute", jp_chars / minutes)
+            # A cache hit says nothing about ASR speed
+            if not actual.get("transcript_cached") and "transcription" in seconds:
+                update("asr_seconds_per_audio_minute", seconds["transcription"] / minutes)
+        if jp_chars:
+            update("correction_input_tokens_per_char", actual.get("input_tokens", 0) / jp_chars)
+            update("correction_output_tokens_per_char", actual.get("output_tokens", 0) / jp_chars)
+            if "correction" in seconds:
+                update("correction_seconds_per_char", seconds["correction"] / jp_chars)
+            if seconds.get("translation"):
+                update("deepl_chars_per_second", jp_chars / seconds["translation"])
+            update("en_chars_per_jp_char", en_chars / jp_chars)
+        if en_chars and "synthesis" in seconds:
+            update("tts_seconds_per_char", seconds["synthesis"] / en_chars)
+
+        errors = {}
+        for stage in STAGES:
+            # The forecast assumes a real transcription, so a cache hit is not an error
+            if stage == "transcription" and actual.get("transcript_cached"):
+                continue
+            if stage in seconds and seconds[stage] > 0:
+                predicted = forecast["stages"][stage]["seconds"]
+                errors[stage] = (predicted - seconds[stage]) / seconds[stage] * 100
+        total_actual = sum(seconds[stage] for stage in errors)
+        if total_actual > 0:
+            total_predicted = sum(forecast["stages"][stage]["seconds"] for stage in errors)
+            errors["total"] = (total_predicted - total_actual) / total_actual * 100
+
+        self.history.add_run({
+            "finished_at": time.time(),
+            "forecast_seconds": {stage: forecast["stages"][stage]["seconds"] for stage in STAGES},
+            "actual_seconds": seconds,
+            "error_percent": errors,
+        })
+        self.history.save()
+
+        print("\n=== Forecast Error ===")
+        for stage, error in errors.items():
+            print(f"{stage}: {error:+.0f}%")
+        print("======================\n")
+        return errors
+
+
+def print_forecast(forecast, label=None):
+    """Print a forecast produced by Estimator.forecast"""
+    print(f"\n=== Forecast{f' for {label}' if label else ''} ===")
+    print(f"Media duration: {forecast['duration_seconds'] / 60:.1f} minutes "
+          f"(~{forecast['jp_chars']:,.0f} JP / ~{forecast['en_chars']:,.0f} EN characters)")
+    for stage, values in forecast["stages"].items():
+        print(f"{stage}: {values['seconds'] / 60:.1f} min, ${values['cost']:.2f}, "
+              f"peak {values['peak_memory_mb']:.0f}MB")
+    print(f"Total: {forecast['total_seconds'] / 60:.1f} min, ${forecast['total_cost']:.2f}, "
+          f"peak {forecast['peak_memory_mb']:.0f}MB")
+    print("=" * 20 + "\n")
+
+
+def pack_jobs(jobs, budget_seconds):
+    """
+    Pack (name, forecast) jobs into batches whose forecast wall time fits the budget
+    (first-fit decreasing). Jobs longer than the budget get a batch of their own.
+    """
+    batches = []
+    for name, forecast in sorted(jobs, key=lambda job: job[1]["total_seconds"], reverse=True):
+        seconds = forecast["total_seconds"]
+        for batch in batches:
+            if batch["seconds"] + seconds <= budget_seconds:
+                batch["jobs"].append(name)
+                batch["seconds"] += seconds
+                break
+        else:
+            batches.append({"jobs": [name], "seconds": seconds})
+    return batches
@@ -3,12 +3,16 @@ File utility functions for VoiceTranslateFlow
 """
 
 import os
+import wave
+import shutil
+import struct
+import subprocess
 from datetime import datetime
-import pytz
 
 
 def get_timestamp():
     """Get current timestamp in Tokyo timezone"""
+    import pytz
     return datetime.now(pytz.timezone('Asia/Tokyo')).strftime("%Y%m%d_%H%M%S")
 
 
@@ -67,6 +71,75 @@ def get_file_info(filepath):
     }
 
 
+def probe_duration_ffprobe(filepath):
+    """Read the container duration with ffprobe (header only, works for URLs too)"""
+    ffprobe = shutil.which("ffprobe")
+    if not ffprobe:
+        return None
+    try:
+        result = subprocess.run(
+            [ffprobe, "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", filepath],
+            capture_output=True, text=True, timeout=30
+        )
+        return float(result.stdout.strip())
+    except (subprocess.SubprocessError, ValueError):
+        return None
+
+
+def read_mp4_duration(filepath):
+    """Read the duration from the mvhd atom of an MP4/M4A/MOV file"""
+    with open(filepath, "rb") as file:
+        end = os.path.getsize(filepath)
+        position = 0
+        while position + 8 <= end:
+            file.seek(position)
+            size, atom = struct.unpack(">I4s", file.read(8))
+            header = 8
+            if size == 1:
+                size = struct.unpack(">Q", file.read(8))[0]
+                header = 16
+            elif size == 0:
+                size = end - position
+            if size < header:
+                return None
+            
+            if atom == b"moov":
+                # Descend into the movie atom
+                end = position + size
+                position += header
+                continue
+            if atom == b"mvhd":
+                version = file.read(1)[0]
+                file.read(3)
+                if version == 1:
+                    file.read(16)
+                    timescale, duration = struct.unpack(">IQ", file.read(12))
+                else:
+                    file.read(8)
+                    timescale, duration = struct.unpack(">II", file.read(8))
+                return duration / timescale if timescale else None
+            position += size
+    return None
+
+
+def get_media_duration(filepath):
+    """Get media duration in seconds from file headers without decoding, or None if unknown"""
+    duration = probe_duration_ffprobe(filepath)
+    if duration is not None or filepath.startswith('http'):
+        return duration
+    
+    extension = os.path.splitext(filepath)[1].lower()
+    try:
+        if extension == '.wav':
+            with wave.open(filepath, 'rb') as wav_file:
+                return wav_file.getnframes() / wav_file.getframerate()
+        if extension in {'.mp4', '.m4a', '.mov'}:
+            return read_mp4_duration(filepath)
+    except (wave.Error, struct.error, OSError, IndexError, EOFError) as e:
+        print(f"Warning: could not read media duration: {e}")
+    return None
+
+
 def validate_media_file(filepath):
     """Validate media file for processing"""
     info = get_file_info(filepath)
@@ -85,6 +158,7 @@ def validate_media_file(filepath):
     if size_mb > max_size_mb:
         print(f"Warning: File size ({size_mb:.1f}MB) is quite large. Processing may take time.")
     
+    info['duration'] = get_media_duration(filepath)
     return info
 
 
@@ -120,6 +194,8 @@ def confirm_file_path(filepath):
         info = validate_media_file(filepath)
         print(f"File size: {info['size'] / (1024 * 1024):.1f}MB")
         print(f"File type: {info['extension']}")
+        if info['duration'] is not None:
+            print(f"Duration: {info['duration'] / 60:.1f} minutes")
     except Exception as e:
         print(f"Warning: {e}")
     
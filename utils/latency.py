@@ -0,0 +1,205 @@
+"""
+Deadlines, latency histograms and hedged requests for VoiceTranslateFlow
+"""
+
+import os
+import json
+import math
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when the job deadline has passed"""
+
+
+class Deadline:
+    def __init__(self, seconds=None):
+        """Create a deadline `seconds` from now (None or 0 means no deadline)"""
+        self.expires_at = time.monotonic() + seconds if seconds else None
+
+    def remaining(self):
+        """Seconds left before the deadline, or None if there is no deadline"""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def timeout(self, default):
+        """Per-call timeout bounded by the time left; raises DeadlineExceeded if none is left"""
+        remaining = self.remaining()
+        if remaining is None:
+            return default
+        if remaining <= 0:
+            raise DeadlineExceeded("Job deadline exceeded")
+        return min(default, remaining) if default else remaining
+
+
+class LatencyHistogram:
+    def __init__(self, min_value=0.001, max_value=3600.0, buckets_per_decade=20):
+        """Log-spaced histogram of latencies in seconds"""
+        self.min_value = min_value
+        self.buckets_per_decade = buckets_per_decade
+        decades = math.log10(max_value / min_value)
+        self.counts = [0] * (int(decades * buckets_per_decade) + 1)
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def _bucket(self, value):
+        value = max(value, self.min_value)
+        index = int(math.log10(value / self.min_value) * self.buckets_per_decade)
+        return min(index, len(self.counts) - 1)
+
+    def _upper_bound(self, index):
+        return self.min_value * 10 ** ((index + 1) / self.buckets_per_decade)
+
+    def record(self, value):
+        with self.lock:
+            self.counts[self._bucket(value)] += 1
+            self.count += 1
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th percentile, or None if empty"""
+        with self.lock:
+            if not self.count:
+                return None
+            target = math.ceil(self.count * p / 100.0)
+            seen = 0
+            for index, bucket_count in enumerate(self.counts):
+                seen += bucket_count
+                if seen >= target:
+                    return self._upper_bound(index)
+        return None
+
+
+class LatencyTracker:
+    def __init__(self, hedge_percentile=95, min_samples=5, history_path=None, max_history_samples=1000):
+        """
+        Latency histograms per operation, used to pick hedging thresholds.
+        With history_path, histograms are loaded from and saved to disk so
+        thresholds are available from the first request of a run.
+        """
+        self.hedge_percentile = hedge_percentile
+        self.min_samples = min_samples
+        self.history_path = history_path
+        self.max_history_samples = max_history_samples
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """Load saved histograms, ignoring a missing or unreadable history file"""
+        if not self.history_path:
+            return
+        try:
+            with open(self.history_path, "r", encoding="utf-8") as file:
+                saved = json.load(file)
+        except (OSError, json.JSONDecodeError):
+            return
+        for operation, counts in saved.items():
+            histogram = LatencyHistogram()
+            if len(counts) == len(histogram.counts):
+                histogram.counts = counts
+                histogram.count = sum(counts)
+                self.histograms[operation] = histogram
+
+    def save(self):
+        """Save histograms, scaling old counts down so recent runs dominate"""
+        if not self.history_path:
+            return
+        saved = {}
+        for operation, histogram in self.histograms.items():
+            counts = list(histogram.counts)
+            if histogram.count > self.max_history_samples:
+                scale = self.max_history_samples / histogram.count
+                counts = [int(count * scale) for count in counts]
+            saved[operation] = counts
+        try:
+            directory = os.path.dirname(self.history_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.history_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                json.dump(saved, file)
+            os.replace(tmp_path, self.history_path)
+        except OSError as e:
+            print(f"Warning: could not save latency history: {e}")
+
+    def histogram(self, operation):
+        with self.lock:
+            if operation not in self.histograms:
+                self.histograms[operation] = LatencyHistogram()
+            return self.histograms[operation]
+
+    def record(self, operation, seconds):
+        self.histogram(operation).record(seconds)
+
+    def hedge_delay(self, operation, scale=1.0):
+        """Delay before sending a hedged duplicate, or None until enough samples exist"""
+        histogram = self.histogram(operation)
+        if histogram.count < self.min_samples:
+            return None
+        return histogram.percentile(self.hedge_percentile) * scale
+
+    def print_summary(self):
+        """Print p50/p95/p99 for every tracked operation"""
+        if not self.histograms:
+            return
+        print("\n=== Request Latency ===")
+        for operation, histogram in sorted(self.histograms.items()):
+            p50, p95, p99 = (histogram.percentile(p) for p in (50, 95, 99))
+            print(f"{operation}: n={histogram.count} p50<={p50:.3f} p95<={p95:.3f} p99<={p99:.3f}")
+        print("=======================\n")
+
+
+def hedged_call(func, delay, deadline=None, timeout=None, on_hedge=None):
+    """
+    Call func(); if it has not finished after `delay` seconds, start a duplicate
+    and return whichever succeeds first. Only use with idempotent operations.
+
+    The wait is bounded by `timeout` and the deadline even when func itself has
+    no timeout, raising DeadlineExceeded when either runs out. on_hedge() is
+    called when a duplicate is sent.
+    """
+    if delay is None and timeout is None and (deadline is None or deadline.remaining() is None):
+        return func()
+
+    def time_left():
+        """Seconds left before the timeout or the deadline, or None if unbounded"""
+        limits = [limit for limit in (
+            None if timeout is None else timeout - (time.monotonic() - start_time),
+            deadline.remaining() if deadline else None,
+        ) if limit is not None]
+        return max(0.0, min(limits)) if limits else None
+
+    start_time = time.monotonic()
+    executor = ThreadPoolExecutor(max_workers=2)
+    try:
+        pending = {executor.submit(func)}
+        done = set()
+        if delay is not None:
+            left = time_left()
+            done, pending = wait(pending, timeout=delay if left is None else min(delay, left))
+            if not done and time_left() != 0:
+                print(f"[Hedge] No response after {delay:.2f}s, sending duplicate request")
+                pending.add(executor.submit(func))
+                if on_hedge:
+                    on_hedge()
+
+        error = None
+        while True:
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+            if not pending:
+                raise error
+            done, pending = wait(pending, timeout=time_left(), return_when=FIRST_COMPLETED)
+            if not done:
+                raise DeadlineExceeded("Request timed out or job deadline exceeded")
+    finally:
+        # Do not block on the slower duplicate; it finishes on its own timeout
+        executor.shutdown(wait=False)
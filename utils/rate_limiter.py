@@ -0,0 +1,240 @@
+"""
+Host-wide API rate limiting for VoiceTranslateFlow
+
+Each provider gets a set of token buckets (requests per minute, tokens per
+minute, characters per second). Bucket state lives in a small JSON file
+guarded by a lock file, so every KoeLink process on the same host draws from
+the same budget.
+"""
+
+import os
+import json
+import time
+import tempfile
+from contextlib import contextmanager
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+
+# Bucket name -> seconds in the quota window
+BUCKET_WINDOWS = {
+    "rpm": 60.0,
+    "tpm": 60.0,
+    "cps": 1.0,
+}
+
+# Response headers understood by update_from_headers: (bucket, limit header, remaining header)
+RATE_LIMIT_HEADERS = [
+    ("rpm", "x-ratelimit-limit-requests", "x-ratelimit-remaining-requests"),
+    ("tpm", "x-ratelimit-limit-tokens", "x-ratelimit-remaining-tokens"),
+    ("rpm", "x-ratelimit-limit", "x-ratelimit-remaining"),
+]
+
+
+@contextmanager
+def file_lock(lock_path):
+    """Hold an exclusive lock on lock_path for the duration of the block"""
+    with open(lock_path, "a+b") as lock_file:
+        if os.name == "nt":
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        else:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if os.name == "nt":
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+class RateLimiter:
+    def __init__(self, limits, state_dir=None, safety_factor=0.9, default_backoff=10.0,
+                 explicit_limits=None):
+        """
+        limits: {provider: {"rpm": n, "tpm": n, "cps": n}}; missing or 0 disables a bucket
+        explicit_limits: {provider: [names]} of limits the user set; the others are
+        defaults that a limit learned from response headers replaces
+        (None treats every configured limit as explicit)
+        """
+        self.limits = limits
+        self.explicit_limits = explicit_limits
+        self.state_dir = state_dir or os.path.join(tempfile.gettempdir(), "koelink_ratelimits")
+        self.safety_factor = safety_factor
+        self.default_backoff = default_backoff
+        os.makedirs(self.state_dir, exist_ok=True)
+
+    def _paths(self, provider):
+        base = os.path.join(self.state_dir, provider)
+        return base + ".json", base + ".lock"
+
+    def _load_state(self, provider, state_path):
+        """Load bucket state and apply the current configuration to it"""
+        try:
+            with open(state_path, "r", encoding="utf-8") as file:
+                state = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            state = {}
+
+        state.setdefault("blocked_until", 0.0)
+        state.setdefault("buckets", {})
+        self._configure_buckets(provider, state, time.time())
+        return state
+
+    def _configure_buckets(self, provider, state, now):
+        """
+        Size every bucket from the configured limit and the limit learned from
+        response headers. An explicitly configured limit caps the learned one; a
+        default limit is replaced by it. Buckets whose limit is disabled (0) in
+        the configuration are removed.
+        """
+        configured = self.limits.get(provider, {})
+        explicit = None if self.explicit_limits is None else self.explicit_limits.get(provider, [])
+        buckets = state["buckets"]
+        for name, window in BUCKET_WINDOWS.items():
+            bucket = buckets.get(name)
+            if name in configured and not configured[name]:
+                buckets.pop(name, None)
+                continue
+
+            learned_limit = bucket and bucket.get("learned_limit")
+            configured_limit = configured.get(name)
+            if learned_limit and explicit is not None and name not in explicit:
+                configured_limit = None
+            limits = [limit for limit in (configured_limit, learned_limit) if limit]
+            if not limits:
+                buckets.pop(name, None)
+                continue
+
+            capacity = min(limits) * self.safety_factor
+            if bucket is None:
+                bucket = buckets[name] = {"tokens": capacity, "updated": now}
+            bucket["configured_limit"] = configured.get(name)
+            bucket["capacity"] = capacity
+            bucket["rate"] = capacity / window
+            bucket["tokens"] = min(bucket["tokens"], capacity)
+
+    def _save_state(self, state_path, state):
+        tmp_path = state_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(state, file)
+        os.replace(tmp_path, state_path)
+
+    def _refill(self, state, now):
+        for bucket in state["buckets"].values():
+            elapsed = max(0.0, now - bucket["updated"])
+            bucket["tokens"] = min(bucket["capacity"], bucket["tokens"] + elapsed * bucket["rate"])
+            bucket["updated"] = now
+
+    def acquire(self, provider, requests=1, tokens=0, chars=0):
+        """Block until the provider's budget allows this call, then consume it"""
+        needs = {"rpm": requests, "tpm": tokens, "cps": chars}
+        state_path, lock_path = self._paths(provider)
+
+        while True:
+            with file_lock(lock_path):
+                now = time.time()
+                state = self._load_state(provider, state_path)
+                self._refill(state, now)
+
+                wait = max(0.0, state["blocked_until"] - now)
+                for name, bucket in state["buckets"].items():
+                    # A single call larger than the bucket could never fit; cap it
+                    need = min(needs.get(name, 0), bucket["capacity"])
+                    if need > bucket["tokens"]:
+                        wait = max(wait, (need - bucket["tokens"]) / bucket["rate"])
+
+                if wait <= 0:
+                    for name, bucket in state["buckets"].items():
+                        bucket["tokens"] -= min(needs.get(name, 0), bucket["capacity"])
+                    self._save_state(state_path, state)
+                    return
+
+                self._save_state(state_path, state)
+
+            print(f"[Rate limit] Waiting {wait:.1f}s for {provider} quota...")
+            time.sleep(wait)
+
+    def update_from_headers(self, provider, headers):
+        """Adjust bucket limits and levels from rate-limit response headers"""
+        if not headers:
+            return
+        headers = {key.lower(): value for key, value in headers.items()}
+
+        updates = {}
+        for name, limit_header, remaining_header in RATE_LIMIT_HEADERS:
+            if name in updates:
+                continue
+            try:
+                limit = float(headers[limit_header])
+                remaining = float(headers[remaining_header])
+            except (KeyError, ValueError):
+                continue
+            updates[name] = (limit, remaining)
+
+        retry_after = parse_retry_after(headers.get("retry-after"))
+        if not updates and retry_after is None:
+            return
+
+        state_path, lock_path = self._paths(provider)
+        with file_lock(lock_path):
+            now = time.time()
+            state = self._load_state(provider, state_path)
+            self._refill(state, now)
+
+            configured = self.limits.get(provider, {})
+            for name, (limit, remaining) in updates.items():
+                if name in configured and not configured[name]:
+                    continue  # Explicitly disabled
+                bucket = state["buckets"].setdefault(
+                    name, {"tokens": limit * self.safety_factor, "updated": now}
+                )
+                bucket["learned_limit"] = limit
+            self._configure_buckets(provider, state, now)
+
+            for name, (limit, remaining) in updates.items():
+                bucket = state["buckets"].get(name)
+                if bucket is None:
+                    continue
+                # The provider's view of what is left is authoritative
+                headroom = remaining - limit * (1 - self.safety_factor)
+                bucket["tokens"] = max(0.0, min(bucket["tokens"], headroom))
+
+            if retry_after is not None:
+                state["blocked_until"] = max(state["blocked_until"], now + retry_after)
+
+            self._save_state(state_path, state)
+
+    def record_rate_limited(self, provider, headers=None):
+        """Pause every process using this provider after a rate-limit (429) response"""
+        headers = {key.lower(): value for key, value in (headers or {}).items()}
+        retry_after = parse_retry_after(headers.get("retry-after"))
+        if retry_after is None:
+            retry_after = self.default_backoff
+
+        state_path, lock_path = self._paths(provider)
+        with file_lock(lock_path):
+            now = time.time()
+            state = self._load_state(provider, state_path)
+            self._refill(state, now)
+            for bucket in state["buckets"].values():
+                bucket["tokens"] = 0.0
+            state["blocked_until"] = max(state["blocked_until"], now + retry_after)
+            self._save_state(state_path, state)
+
+        print(f"[Rate limit] {provider} rate limit hit. Pausing for {retry_after:.1f}s")
+
+
+def parse_retry_after(value):
+    """Parse a Retry-After header value in seconds, returning None if absent or invalid"""
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
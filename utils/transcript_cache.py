@@ -0,0 +1,154 @@
+"""
+Content-addressed transcript cache for VoiceTranslateFlow
+
+Transcripts are stored under a hash of the media content rather than its name
+or URL, so re-exports and re-uploads of the same audio skip SpeechFlow entirely.
+"""
+
+import os
+import json
+import time
+import hashlib
+import shutil
+import threading
+import subprocess
+
+import requests
+
+from utils.latency import Deadline
+from utils.rate_limiter import file_lock
+
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+class TranscriptCache:
+    def __init__(self, cache_dir="./cache/transcripts", key_mode="audio", request_timeout=120,
+                 decode_timeout=600):
+        """
+        key_mode: "audio" hashes the decoded PCM stream (stable across containers and
+        metadata changes, needs ffmpeg); "file" hashes the raw bytes (fast path)
+        """
+        if key_mode not in ("audio", "file"):
+            raise ValueError(f"Unsupported transcript cache key mode: {key_mode} (supported: audio, file)")
+        self.cache_dir = cache_dir
+        self.key_mode = key_mode
+        self.request_timeout = request_timeout
+        self.decode_timeout = decode_timeout
+        self.stats_path = os.path.join(cache_dir, "stats.json")
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def hash_file_bytes(self, file_path):
+        """Streaming SHA-256 of a local file or URL"""
+        digest = hashlib.sha256()
+        if file_path.startswith('http'):
+            with requests.get(file_path, stream=True, timeout=self.request_timeout) as response:
+                response.raise_for_status()
+                for block in response.iter_content(HASH_BLOCK_SIZE):
+                    digest.update(block)
+        else:
+            with open(file_path, "rb") as file:
+                for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b""):
+                    digest.update(block)
+        return "file-" + digest.hexdigest()
+
+    def hash_decoded_audio(self, file_path, timeout=None):
+        """
+        Streaming SHA-256 of the decoded mono 16 kHz PCM, or None if ffmpeg is
+        unavailable, fails or does not finish within `timeout` seconds
+        """
+        ffmpeg = shutil.which("ffmpeg")
+        if not ffmpeg:
+            return None
+
+        digest = hashlib.sha256()
+        process = subprocess.Popen(
+            [ffmpeg, "-v", "error", "-i", file_path, "-vn", "-ac", "1", "-ar", "16000", "-f", "s16le", "-"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+        )
+        # Reads block on the pipe, so a timer kills ffmpeg once the time is up
+        timed_out = threading.Event()
+
+        def kill():
+            timed_out.set()
+            process.kill()
+
+        timer = threading.Timer(timeout, kill) if timeout else None
+        if timer:
+            timer.start()
+        try:
+            for block in iter(lambda: process.stdout.read(HASH_BLOCK_SIZE), b""):
+                digest.update(block)
+            process.stdout.close()
+            return_code = process.wait()
+        finally:
+            if timer:
+                timer.cancel()
+        if timed_out.is_set():
+            print(f"Audio decoding for hashing did not finish within {timeout:.1f}s")
+            return None
+        if return_code != 0:
+            return None
+        return "audio-" + digest.hexdigest()
+
+    def key_for(self, file_path, lang, result_type, deadline=None):
+        """Cache key for a media file and transcription settings"""
+        content_hash = None
+        if self.key_mode == "audio":
+            timeout = (deadline or Deadline()).timeout(self.decode_timeout)
+            content_hash = self.hash_decoded_audio(file_path, timeout)
+            if content_hash is None:
+                print("Could not decode audio for hashing; falling back to file bytes")
+        if content_hash is None:
+            content_hash = self.hash_file_bytes(file_path)
+        return f"{content_hash}_{lang}_{result_type}"
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def load(self, key):
+        """Return the cached entry for key, or None"""
+        try:
+            with open(self.entry_path(key), "r", encoding="utf-8") as file:
+                return json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def store(self, key, result, task_metadata):
+        """Store a raw SpeechFlow result together with its task metadata"""
+        entry = {
+            "result": result,
+            "task": dict(task_metadata, cached_at=time.time()),
+        }
+        tmp_path = self.entry_path(key) + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(entry, file, ensure_ascii=False)
+        os.replace(tmp_path, self.entry_path(key))
+
+    def load_stats(self):
+        try:
+            with open(self.stats_path, "r", encoding="utf-8") as file:
+                return json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {"hits": 0, "misses": 0, "saved_upload_bytes": 0}
+
+    def record(self, hit, upload_bytes=0):
+        """Update cumulative hit/miss statistics and print them"""
+        # Read-modify-write under a lock so concurrent runs do not lose counts
+        with file_lock(self.stats_path + ".lock"):
+            stats = self.load_stats()
+            if hit:
+                stats["hits"] += 1
+                stats["saved_upload_bytes"] += upload_bytes
+            else:
+                stats["misses"] += 1
+            tmp_path = self.stats_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                json.dump(stats, file)
+            os.replace(tmp_path, self.stats_path)
+
+        lookups = stats["hits"] + stats["misses"]
+        print(f"[Transcript cache] {'Hit' if hit else 'Miss'}. Hit rate: {stats['hits']}/{lookups} "
+              f"({stats['hits'] / lookups * 100:.1f}%), saved uploads: "
+              f"{stats['saved_upload_bytes'] / (1024 * 1024):.1f}MB")